@@ -1,26 +1,25 @@
 # app/auth/auth_bearer.py
 
-from fastapi import Request, HTTPException
+from fastapi import Depends, Request, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
+from deps import get_session
 from .auth_handler import decode_jwt
-from app.auth.auth_handler import INVALID_TOKEN
 
 class JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
         super(JWTBearer, self).__init__(auto_error=auto_error)
 
-    async def __call__(self, request: Request):
+    async def __call__(self, request: Request, session: AsyncSession = Depends(get_session)):
         credentials: HTTPAuthorizationCredentials = await super(JWTBearer, self).__call__(request)
         if credentials:
-            if not self.verify_jwt(credentials.credentials):
+            if not await self.verify_jwt(credentials.credentials, session):
                 raise HTTPException(status_code=403, detail="Invalid or expired token.")
             return credentials.credentials
         else:
             raise HTTPException(status_code=403, detail="Invalid authorization code.")
 
-    def verify_jwt(self, token: str, session) -> bool:
-        if token in INVALID_TOKEN:
-            print(1)
-            return None
-        payload = decode_jwt(token,session)
+    async def verify_jwt(self, token: str, session: AsyncSession) -> dict | None:
+        # revoked tokens are rejected inside decode_jwt by their jti
+        payload = await decode_jwt(token, session)
         return payload
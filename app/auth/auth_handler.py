@@ -1,67 +1,95 @@
 # app/auth/auth_handler.py
 
+import asyncio
+import logging
 import time
 from typing import Dict
 import jwt
 import os
 from config import settings
 from app.users.crud import UserServiceHandler
-from sqlmodel import Session
-from uuid import UUID
-from asgiref.sync import async_to_sync
+from sqlalchemy.ext.asyncio import AsyncSession
+from uuid import UUID, uuid4
+from app.auth.revocation import build_revocation_store
+
+logger = logging.getLogger(__name__)
 
 
 SECRET_KEY = settings.SECRET_KEY
 ACCESS_TOKEN_EXPIRE_SECONDS = settings.ACCESS_TOKEN_EXPIRE_SECONDS
 ALGORITHM = settings.ALGORITHM
-INVALID_TOKEN = set()
+revocation_store = build_revocation_store(settings.TOKEN_REVOCATION_BACKEND, settings.TOKEN_REVOCATION_URL)
 
 def sign_jwt(user_id: UUID) -> Dict[str, str]:
-    access_payload = {
-        "user_id": user_id,
-        "exp": time.time() + ACCESS_TOKEN_EXPIRE_SECONDS,
-        "type": "access"
-    }
     refresh_payload = {
         "user_id": user_id,
         "exp": time.time() + (60 * 60 * 24 * 7),  # 7 days
-        "type": "refresh"
+        "type": "refresh",
+        "jti": uuid4().hex
     }
 
-    access_token = jwt.encode(access_payload, SECRET_KEY, algorithm=ALGORITHM)
+    access_token = create_access_token(user_id, refresh_payload)["access_token"]
     refresh_token = jwt.encode(refresh_payload, SECRET_KEY, algorithm=ALGORITHM)
 
     return {"access_token": access_token, "refresh_token": refresh_token}
 
-def create_access_token(user_id: UUID) -> str:
+def create_access_token(user_id: UUID, refresh_payload: dict) -> str:
     access_payload = {
         "user_id": user_id,
         "exp": time.time() + ACCESS_TOKEN_EXPIRE_SECONDS,
-        "type": "access"
+        "type": "access",
+        "jti": uuid4().hex,
+        # the refresh token this one was issued with, logout revokes both
+        "refresh_jti": refresh_payload["jti"],
+        "refresh_exp": refresh_payload["exp"],
     }
     access_token = jwt.encode(access_payload, SECRET_KEY, algorithm=ALGORITHM)
     return {"access_token": access_token}
 
-def decode_jwt(token: str, session: Session) -> dict | None:
+async def _store(method, *args):
+    if revocation_store.blocking:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+async def revoke_token(payload: dict) -> None:
+    '''
+    revokes the token and, for an access token, the refresh token it was issued with
+    '''
+    for jti, exp in ((payload.get("jti"), payload.get("exp")), (payload.get("refresh_jti"), payload.get("refresh_exp"))):
+        if jti and exp:
+            await _store(revocation_store.revoke, jti, exp)
+
+async def decode_jwt(token: str, session: AsyncSession) -> dict | None:
+    '''
+    the token payload when it is valid, not revoked and its user is active and
+    not banned, else None. the user status comes from user_status_cache, a
+    miss is one awaited query on the request's session.
+    '''
     try:
-        handler = UserServiceHandler(session=session)
         decoded_token = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(decoded_token)
         if decoded_token["exp"] < time.time():
-            print(1)
+            logger.debug("token rejected", extra={"reason": "expired"})
             return None
 
         user_id = decoded_token.get("user_id")
         if not user_id:
-            print(0)
+            logger.debug("token rejected", extra={"reason": "no user_id"})
+            return None
+        # the claim is a string, handlers bind it against uuid columns
+        user_id = decoded_token["user_id"] = UUID(user_id)
+
+        jti = decoded_token.get("jti")
+        if jti and await _store(revocation_store.is_revoked, jti):
+            logger.debug("token rejected", extra={"reason": "revoked", "user_id": user_id})
             return None
 
-        user = async_to_sync(handler.get_user_by_id)(user_id=user_id)
-        if not user or not user.is_active:
-            print(2)
+        status = await UserServiceHandler(session=session).get_user_status(user_id=user_id)
+        if not status or not status.is_active or status.is_banned:
+            logger.debug("token rejected", extra={"reason": "inactive or banned", "user_id": user_id})
             return None
 
         return decoded_token  # valid payload
     except Exception:
+        logger.debug("token rejected", exc_info=True)
         return None
 
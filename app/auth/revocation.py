@@ -0,0 +1,139 @@
+'''
+revoked token store, keyed by the `jti` claim that sign_jwt puts in every token.
+an entry is only kept until the token's own `exp`, after that the signature
+check rejects the token anyway so there is nothing left to remember.
+'''
+import heapq
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from sqlalchemy import Column, Float, MetaData, String, Table, create_engine, delete, event, insert, select
+from sqlalchemy.exc import IntegrityError
+
+
+class RevocationStore(ABC):
+    # True when the methods do blocking io and have to run off the event loop
+    blocking = False
+
+    @abstractmethod
+    def revoke(self, jti: str, expires_at: float) -> None:
+        ...
+
+    @abstractmethod
+    def is_revoked(self, jti: str) -> bool:
+        ...
+
+    @abstractmethod
+    def purge_expired(self) -> int:
+        ...
+
+
+class InMemoryRevocationStore(RevocationStore):
+    '''
+    per process store, fine for a single worker or for tests.
+    expired entries are dropped lazily on lookup and in bulk from a min-heap on revoke.
+    '''
+
+    def __init__(self):
+        self._expiry: dict[str, float] = {}
+        self._heap: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def revoke(self, jti: str, expires_at: float) -> None:
+        with self._lock:
+            self._expiry[jti] = expires_at
+            heapq.heappush(self._heap, (expires_at, jti))
+        self.purge_expired()
+
+    def is_revoked(self, jti: str) -> bool:
+        expires_at = self._expiry.get(jti)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            self._expiry.pop(jti, None)
+            return False
+        return True
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        purged = 0
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, jti = heapq.heappop(self._heap)
+                if self._expiry.get(jti) == expires_at:
+                    del self._expiry[jti]
+                    purged += 1
+        return purged
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+
+metadata = MetaData()
+
+revoked_tokens = Table(
+    "revoked_tokens",
+    metadata,
+    Column("jti", String(64), primary_key=True),
+    Column("expires_at", Float, nullable=False, index=True),
+)
+
+
+class SQLRevocationStore(RevocationStore):
+    '''
+    store shared by every worker through a small table, either a local sqlite
+    file (sqlite:///./revoked_tokens.db) or a postgres table
+    (postgresql+psycopg2://...). lookups are a primary key probe.
+    '''
+    blocking = True
+
+    def __init__(self, url: str, purge_every: int = 500):
+        connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+        self.engine = create_engine(url, connect_args=connect_args)
+        if url.startswith("sqlite"):
+            event.listen(self.engine, "connect", _sqlite_wal)
+        metadata.create_all(self.engine)
+        self.purge_every = purge_every
+        self._revokes = 0
+
+    def revoke(self, jti: str, expires_at: float) -> None:
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(revoked_tokens).values(jti=jti, expires_at=expires_at))
+        except IntegrityError:
+            # already revoked
+            pass
+        self._revokes += 1
+        if self._revokes % self.purge_every == 0:
+            self.purge_expired()
+
+    def is_revoked(self, jti: str) -> bool:
+        statement = select(revoked_tokens.c.jti).where(
+            revoked_tokens.c.jti == jti,
+            revoked_tokens.c.expires_at > time.time(),
+        )
+        with self.engine.connect() as conn:
+            return conn.execute(statement).first() is not None
+
+    def purge_expired(self) -> int:
+        with self.engine.begin() as conn:
+            result = conn.execute(delete(revoked_tokens).where(revoked_tokens.c.expires_at <= time.time()))
+            return result.rowcount
+
+
+def _sqlite_wal(dbapi_connection, connection_record):
+    # let readers in other workers proceed while one worker writes
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def build_revocation_store(backend: str, url: str | None = None) -> RevocationStore:
+    if backend == "memory":
+        return InMemoryRevocationStore()
+    if backend == "sql":
+        if not url:
+            raise ValueError("TOKEN_REVOCATION_URL is required for the sql revocation backend")
+        return SQLRevocationStore(url)
+    raise ValueError(f"Unknown token revocation backend : {backend}")
@@ -7,16 +7,14 @@ from app.users.models import User  # Your SQLModel user model
 from app.auth.schemas import LoginSchema,ResponseSchema
 from app.users.crud import UserServiceHandler
 from deps import get_session
-from passlib.context import CryptContext
-from app.auth.auth_handler import sign_jwt, decode_jwt, create_access_token
-from app.auth.auth_handler import INVALID_TOKEN
+from app.auth.hashing import password_hasher
+from app.auth.auth_handler import sign_jwt, decode_jwt, create_access_token, revoke_token
 from app.users.schemas import CreateUserSchema
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from asgiref.sync import sync_to_async
 from app.auth.auth_bearer import JWTBearer
 
 router = APIRouter()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 jwt_handler = JWTBearer()
 
 security = HTTPBearer()
@@ -41,17 +39,20 @@ class AuthAPIWrapper:
         if not user:
             return ResponseSchema(message="User not found", status="error", status_code=404)
 
-        verified = await sync_to_async(pwd_context.verify)(login_data.password, user.password)
+        verified, new_hash = await password_hasher.verify(login_data.password, user.password)
         if not verified:
             return ResponseSchema(message="Invalid password", status="error", status_code=401)
 
         tokens = await sync_to_async(sign_jwt)(str(user.id))
-        await handler.update_user(user_id=user.id,update_data={"is_active":True})
+        update_data = {"is_active":True}
+        if new_hash:
+            # stored hash uses outdated settings, swap it while we have the plain password
+            update_data["password"] = new_hash
+        await handler.update_user(user_id=user.id,update_data=update_data)
         return ResponseSchema(message="Login successful", status="success", status_code=200, data_dict=tokens)
 
     @router.post("/logout/", response_model=ResponseSchema)
     async def logout(token: HTTPAuthorizationCredentials = Depends(security), session: Session = Depends(get_session)):
-        print(token)
         handler = UserServiceHandler(session)
         if not token.credentials:
             return ResponseSchema(
@@ -59,16 +60,17 @@ class AuthAPIWrapper:
                 status="error",
                 status_code=400
             )
-        user = await sync_to_async(jwt_handler.verify_jwt)(token.credentials,session)
+        user = await jwt_handler.verify_jwt(token.credentials, session)
         if not user:
             return ResponseSchema(
                 message="error user not found",
                 status="error",
                 status_code=400
             )
+        # update_user also drops the user from user_status_cache
         await handler.update_user(user_id=user.get("user_id"),update_data={"is_active":False})
         
-        INVALID_TOKEN.add(token.credentials)  # you implement
+        await revoke_token(user)
         return ResponseSchema(
             message="Successfully logged out",
             status="success",
@@ -82,7 +84,7 @@ class AuthAPIWrapper:
         if existing_user:
             raise ResponseSchema(status_code=400, message="Email already registered", status="error")
         
-        user_data.password = await sync_to_async(pwd_context.hash)(user_data.password)
+        user_data.password = await password_hasher.hash(user_data.password)
         new_user = await handler.create_user(user_data)
         tokens = await sync_to_async(sign_jwt)(str(new_user.id))
         return ResponseSchema(
@@ -95,15 +97,15 @@ class AuthAPIWrapper:
     @router.post("/refresh/", response_model=ResponseSchema)
     async def refresh_token(refresh_token: HTTPAuthorizationCredentials = Depends(security), session: Session = Depends(get_session)):
         try:
-            payload = await sync_to_async(decode_jwt)(refresh_token, session)
-            if payload["type"] != "refresh":
+            payload = await decode_jwt(refresh_token.credentials, session)
+            if not payload or payload["type"] != "refresh":
                 raise HTTPException(status_code=401, detail="Invalid refresh token")
-            new_access_token = await sync_to_async(create_access_token)(payload["user_id"])
+            new_access_token = await sync_to_async(create_access_token)(str(payload["user_id"]), payload)
             return ResponseSchema(
                 message="Token refreshed",
                 status="success",
                 status_code=200,
-                data={"access_token": new_access_token}
+                data_dict=new_access_token
             )
         except Exception:
             raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
@@ -0,0 +1,146 @@
+'''
+small in-process caches shared by the handlers
+'''
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    '''
+    bounded LRU cache where every entry also expires after `ttl` seconds.
+    it is guarded by a lock because the auth path reads it from worker threads.
+    '''
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+class LoadingCache(TTLCache):
+    '''
+    TTLCache that loads missing keys itself with single-flight: concurrent
+    misses on one key share a single load instead of each querying. a None
+    result is returned but not cached. asyncio only, use it from the event loop.
+
+    invalidate() also detaches a load that is still running, its result may
+    predate the write that caused the invalidation so it is never cached.
+    '''
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 60.0):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._loads: dict[Hashable, asyncio.Task] = {}
+        self.loads = 0
+        self.coalesced = 0
+        self.load_errors = 0
+
+    async def get_or_load(self, key: Hashable, load) -> Any:
+        '''
+        load -> zero argument coroutine function. it runs in its own task, so
+        it must not use the session of the request that triggered it.
+        '''
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        task = self._loads.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, load))
+            self._loads[key] = task
+            task.add_done_callback(lambda done: self._load_done(key, done))
+        else:
+            self.coalesced += 1
+        # a waiter that gets cancelled must not cancel the load the others wait for
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, load) -> Any:
+        self.loads += 1
+        try:
+            value = await load()
+        except Exception:
+            self.load_errors += 1
+            raise
+        if value is not None and self._loads.get(key) is asyncio.current_task():
+            self.set(key, value)
+        return value
+
+    def _load_done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._loads.get(key) is task:
+            del self._loads[key]
+        if not task.cancelled():
+            # retrieved here so a failed load nobody waited for is not logged as unhandled
+            task.exception()
+
+    def invalidate(self, key: Hashable) -> None:
+        self._loads.pop(key, None)
+        super().invalidate(key)
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+            "load_errors": self.load_errors,
+            "in_flight": len(self._loads),
+        }
@@ -0,0 +1,230 @@
+'''
+engines, session factory and pool instrumentation.
+
+engines are built on first use (or by warm_pool() at startup) instead of on
+import, and closed by dispose_engines() on shutdown.
+
+every session talks to the primary unless a handler method is wrapped in
+@read_only, then its queries go to the replica engine (when REPLICA_DATABASE_URL
+is set). once a session has flushed a write it stays on the primary so a
+request always reads its own writes.
+
+rows of soft-deletable models (register_soft_delete) with is_delete set are
+left out of every ORM select, relationship loads included, unless the
+statement opts in with .execution_options(include_deleted=True).
+'''
+import asyncio
+import functools
+import inspect
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, with_loader_criteria
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.core.metrics import instrument_engine
+from config import settings
+
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+
+def _instrumented_pool_class(stats: PoolStats):
+    '''
+    queue pool that times how long callers wait for a connection.
+    stats lives on the class so it survives pool.recreate() on dispose.
+    '''
+
+    class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            except Exception:
+                stats.timeouts += 1
+                raise
+            finally:
+                stats.record_wait(time.perf_counter() - started)
+
+    InstrumentedQueuePool.stats = stats
+    return InstrumentedQueuePool
+
+
+def build_engine(url: str) -> AsyncEngine:
+    connect_args = {}
+    if url.startswith("postgresql+asyncpg"):
+        connect_args["prepared_statement_cache_size"] = settings.DB_STATEMENT_CACHE_SIZE
+
+    kwargs = {}
+    if not url.startswith("sqlite"):
+        kwargs = dict(
+            poolclass=_instrumented_pool_class(PoolStats()),
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+        )
+    db_engine = create_async_engine(url, echo=settings.DB_ECHO, connect_args=connect_args, **kwargs)
+    if settings.METRICS_ENABLED:
+        instrument_engine(db_engine)
+    return db_engine
+
+
+# "primary" / "replica" -> engine, filled lazily
+_engines: dict[str, AsyncEngine] = {}
+
+
+def get_engine() -> AsyncEngine:
+    db_engine = _engines.get("primary")
+    if db_engine is None:
+        db_engine = _engines["primary"] = build_engine(settings.DATABASE_URL)
+    return db_engine
+
+
+def get_replica_engine() -> AsyncEngine | None:
+    if not settings.REPLICA_DATABASE_URL:
+        return None
+    db_engine = _engines.get("replica")
+    if db_engine is None:
+        db_engine = _engines["replica"] = build_engine(settings.REPLICA_DATABASE_URL)
+    return db_engine
+
+
+async def warm_pool(connections: int) -> int:
+    '''
+    opens `connections` connections per engine at the same time (at most
+    DB_POOL_SIZE) and hands them back to the pool, so the first requests after
+    a deploy don't pay for connection setup. returns how many were opened.
+    '''
+    opened = 0
+    for db_engine in filter(None, (get_engine(), get_replica_engine())):
+        conns = [db_engine.connect() for _ in range(min(connections, settings.DB_POOL_SIZE))]
+        try:
+            await asyncio.gather(*(conn.start() for conn in conns))
+            opened += len(conns)
+        finally:
+            await asyncio.gather(*(conn.close() for conn in conns), return_exceptions=True)
+    return opened
+
+
+async def dispose_engines() -> None:
+    engines = list(_engines.values())
+    _engines.clear()
+    for db_engine in engines:
+        await db_engine.dispose()
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if (
+            self.info.get("read_only", 0)
+            and not self.info.get("pinned_primary")
+            and not self._flushing
+        ):
+            replica = get_replica_engine()
+            if replica is not None:
+                return replica.sync_engine
+        return get_engine().sync_engine
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _pin_to_primary(session, flush_context):
+    session.info["pinned_primary"] = True
+
+
+_soft_delete_models: list = []
+
+
+def register_soft_delete(*models) -> None:
+    '''
+    `models` need a nullable is_delete column, NULL on live rows
+    '''
+    _soft_delete_models.extend(model for model in models if model not in _soft_delete_models)
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _exclude_soft_deleted(state):
+    if (
+        state.is_select
+        # refreshing an object already loaded must still work after it was soft deleted
+        and not state.is_column_load
+        and not state.execution_options.get("include_deleted", False)
+    ):
+        state.statement = state.statement.options(*(
+            with_loader_criteria(model, lambda cls: cls.is_delete.is_(None), include_aliases=True)
+            for model in _soft_delete_models
+        ))
+
+
+async_session_maker = async_sessionmaker(
+    sync_session_class=RoutingSession, class_=AsyncSession, expire_on_commit=False
+)
+
+
+def read_only(method):
+    '''
+    marks a handler method (with a `self.session`) as safe to run on the replica
+    '''
+
+    if inspect.isasyncgenfunction(method):
+        @functools.wraps(method)
+        async def stream_wrapper(self, *args, **kwargs):
+            info = self.session.info
+            info["read_only"] = info.get("read_only", 0) + 1
+            try:
+                async for item in method(self, *args, **kwargs):
+                    yield item
+            finally:
+                info["read_only"] -= 1
+
+        return stream_wrapper
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        info = self.session.info
+        info["read_only"] = info.get("read_only", 0) + 1
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            info["read_only"] -= 1
+
+    return wrapper
+
+
+def _engine_stats(db_engine: AsyncEngine) -> dict:
+    pool = db_engine.pool
+    data = {"status": pool.status()}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        data.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=settings.DB_MAX_OVERFLOW,
+        )
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        data.update(
+            checkouts=stats.checkouts,
+            timeouts=stats.timeouts,
+            wait_seconds_total=round(stats.wait_seconds_total, 6),
+            wait_seconds_avg=round(stats.wait_seconds_total / stats.checkouts, 6) if stats.checkouts else 0.0,
+            wait_seconds_max=round(stats.wait_seconds_max, 6),
+        )
+    return data
+
+
+def pool_stats() -> dict:
+    return {name: _engine_stats(db_engine) for name, db_engine in _engines.items()}
@@ -0,0 +1,235 @@
+'''
+durable background jobs in a postgres table.
+
+enqueue() only adds a Job row to the caller's session, so the job commits or
+rolls back together with the work that asked for it. workers claim a batch of
+due jobs with SELECT ... FOR UPDATE SKIP LOCKED (highest priority, then
+oldest first), so any number of workers in any number of processes never pick
+the same job. a job that raises is retried with exponential backoff until
+max_attempts, then left as "failed". a job whose worker died is picked up
+again once its lease runs out.
+
+workers run inside the api process (JOBS_RUN_IN_APP) and/or on their own with
+`python -m app.worker`.
+'''
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from uuid import UUID, uuid4
+
+from sqlalchemy import JSON, Column, Index, Text, delete, select, text, update
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import Field, SQLModel
+
+from app.core.database import async_session_maker
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+FAILED = "failed"
+
+
+class Job(SQLModel, table=True):
+    __tablename__ = "jobs"
+
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    kind: str = Field(max_length=100)
+    payload: dict = Field(default_factory=dict, sa_column=Column(JSON().with_variant(JSONB, "postgresql"), nullable=False))
+    priority: int = Field(default=0)
+    status: str = Field(default=QUEUED, max_length=20)
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=5)
+    run_at: datetime = Field(default_factory=datetime.now, nullable=False)
+    locked_until: datetime | None = Field(default=None)
+    last_error: str | None = Field(default=None, sa_column=Column(Text))
+    created_at: datetime = Field(default_factory=datetime.now, nullable=False)
+
+
+# only queued jobs are ever scanned by claim(), in claim order
+Index(
+    "ix_jobs_claim",
+    Job.priority.desc(),
+    Job.run_at,
+    postgresql_where=text("status = 'queued'"),
+)
+Index("ix_jobs_running_lease", Job.locked_until, postgresql_where=text("status = 'running'"))
+
+
+def enqueue(session: AsyncSession, kind: str, payload: dict, priority: int = 0, delay: float = 0, max_attempts: int | None = None) -> Job:
+    '''
+    adds the job to `session`, it becomes visible to workers when the caller commits
+    '''
+    if kind not in job_registry:
+        raise ValueError(f"Unknown job kind : {kind}")
+    job = Job(
+        kind=kind,
+        payload=payload,
+        priority=priority,
+        run_at=datetime.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+    session.add(job)
+    return job
+
+
+class JobRegistry(dict):
+    '''
+    kind -> async handler(session, payload). a handler must be safe to run
+    more than once for the same payload, a retry or an expired lease reruns it.
+    '''
+
+    def register(self, kind: str):
+        def decorator(handler):
+            if kind in self:
+                raise ValueError(f"Job kind already registered : {kind}")
+            self[kind] = handler
+            return handler
+
+        return decorator
+
+
+job_registry = JobRegistry()
+
+
+class JobWorker:
+    def __init__(self, concurrency: int, batch_size: int, poll_interval: float, lease_seconds: int, retry_base_seconds: float):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self._task: asyncio.Task | None = None
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.requeued = 0
+
+    async def claim(self) -> list[Job]:
+        now = datetime.now()
+        due = (
+            select(Job.id)
+            .where(Job.status == QUEUED, Job.run_at <= now)
+            .order_by(Job.priority.desc(), Job.run_at)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        statement = (
+            update(Job)
+            .where(Job.id.in_(due.scalar_subquery()))
+            .values(status=RUNNING, attempts=Job.attempts + 1, locked_until=now + timedelta(seconds=self.lease_seconds))
+            .returning(Job)
+            .execution_options(synchronize_session=False)
+        )
+        async with async_session_maker() as session:
+            jobs = (await session.execute(statement)).scalars().all()
+            await session.commit()
+        return list(jobs)
+
+    async def requeue_expired(self) -> int:
+        '''
+        running jobs whose lease ran out belong to a worker that died
+        '''
+        async with async_session_maker() as session:
+            result = await session.execute(
+                update(Job)
+                .where(Job.status == RUNNING, Job.locked_until < datetime.now())
+                .values(status=QUEUED, locked_until=None, run_at=datetime.now())
+            )
+            await session.commit()
+        self.requeued += result.rowcount
+        return result.rowcount
+
+    async def _run_one(self, job: Job) -> None:
+        handler = job_registry.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f"no handler registered for job kind {job.kind}")
+            async with async_session_maker() as session:
+                await handler(session, job.payload)
+                await session.execute(delete(Job).where(Job.id == job.id))
+                await session.commit()
+            self.completed += 1
+        except Exception as e:
+            await self._fail(job, e)
+
+    async def _fail(self, job: Job, error: Exception) -> None:
+        retry = job.attempts < job.max_attempts
+        values = {"locked_until": None, "last_error": f"{type(error).__name__}: {error}"[:2000]}
+        if retry:
+            # exponential backoff with jitter so a burst of failures doesn't retry in lockstep
+            backoff = self.retry_base_seconds * 2 ** (job.attempts - 1) * random.uniform(0.8, 1.2)
+            values.update(status=QUEUED, run_at=datetime.now() + timedelta(seconds=min(backoff, 3600)))
+            self.retried += 1
+        else:
+            values.update(status=FAILED)
+            self.failed += 1
+        logger.warning(
+            "job failed",
+            extra={"job_id": str(job.id), "kind": job.kind, "attempt": job.attempts, "will_retry": retry, "error": values["last_error"]},
+        )
+        async with async_session_maker() as session:
+            await session.execute(update(Job).where(Job.id == job.id).values(**values))
+            await session.commit()
+
+    async def run_once(self) -> int:
+        jobs = await self.claim()
+        if jobs:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def limited(job):
+                async with semaphore:
+                    await self._run_one(job)
+
+            await asyncio.gather(*(limited(job) for job in jobs))
+        return len(jobs)
+
+    async def run(self) -> None:
+        loops = 0
+        while True:
+            try:
+                if loops % 30 == 0:
+                    await self.requeue_expired()
+                loops += 1
+                if not await self.run_once():
+                    await asyncio.sleep(self.poll_interval)
+            except Exception:
+                logger.exception("job worker loop failed")
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        '''
+        jobs cut off here keep their "running" status and are requeued once their lease expires
+        '''
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "requeued": self.requeued,
+        }
+
+
+job_worker = JobWorker(
+    concurrency=settings.JOB_CONCURRENCY,
+    batch_size=settings.JOB_BATCH_SIZE,
+    poll_interval=settings.JOB_POLL_INTERVAL,
+    lease_seconds=settings.JOB_LEASE_SECONDS,
+    retry_base_seconds=settings.JOB_RETRY_BASE_SECONDS,
+)
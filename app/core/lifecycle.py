@@ -0,0 +1,69 @@
+'''
+worker startup timings and readiness.
+
+the warm-up steps run in a background task after the lifespan startup, so the
+worker accepts connections (and answers the liveness route) straight away
+while /ready/ keeps answering 503 until every step has succeeded once. a
+failed warm-up, e.g. the database not being reachable yet, is retried with
+backoff.
+'''
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    def __init__(self):
+        self.ready = False
+        self.error: str | None = None
+        self.attempts = 0
+        # step name -> seconds, plus import_seconds and warmup_seconds
+        self.timings: dict[str, float] = {}
+        self._task: asyncio.Task | None = None
+
+    def record(self, name: str, seconds: float) -> None:
+        self.timings[name] = round(seconds, 4)
+
+    def start_warm_up(self, steps: list) -> None:
+        '''
+        steps -> [(name, async callable)], run in order
+        '''
+        if self._task is None:
+            self._task = asyncio.create_task(self._warm_up(steps))
+
+    async def _warm_up(self, steps: list) -> None:
+        started = time.perf_counter()
+        while True:
+            self.attempts += 1
+            try:
+                for name, step in steps:
+                    step_started = time.perf_counter()
+                    await step()
+                    self.record(f"{name}_seconds", time.perf_counter() - step_started)
+                break
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                logger.exception("warm up failed", extra={"attempt": self.attempts})
+                await asyncio.sleep(min(30, 2 ** self.attempts))
+        self.record("warmup_seconds", time.perf_counter() - started)
+        self.error = None
+        self.ready = True
+        logger.info("worker ready", extra=self.timings)
+
+    async def stop(self) -> None:
+        self.ready = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        return {"ready": self.ready, "attempts": self.attempts, "error": self.error, "timings": self.timings}
+
+
+startup = Startup()
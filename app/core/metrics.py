@@ -0,0 +1,210 @@
+'''
+request and query metrics, exposed in the prometheus text format at /metrics.
+
+MetricsMiddleware times every request and keeps a RequestStats in a context
+variable, the cursor execute hooks installed by instrument_engine() add every
+query run on behalf of that request to it. a statement executed
+N_PLUS_ONE_THRESHOLD times or more within one request is logged as a likely
+N+1. all series are per worker, prometheus sums them across workers.
+'''
+import bisect
+import contextvars
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, **extra) -> str:
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labels
+        self._series: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, value in series:
+            lines.append(f"{self.name}{_labels(self.labelnames, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: tuple, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labelnames = labels
+        # label values -> [count per bucket..., sum, count], buckets are made cumulative on render
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((label_values, list(series)) for label_values, series in self._series.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, label_values, le=bound)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, label_values, le='+Inf')} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, label_values)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, label_values)} {series[-1]}")
+        return lines
+
+
+REGISTRY: list = []
+
+http_requests = Counter("http_requests_total", "Requests handled", ("method", "route", "status"))
+http_request_seconds = Histogram("http_request_duration_seconds", "Request latency", LATENCY_BUCKETS, ("method", "route"))
+db_query_seconds = Histogram("db_query_duration_seconds", "Latency of single queries", QUERY_BUCKETS)
+db_queries_per_request = Histogram("db_queries_per_request", "Queries run by one request", QUERY_COUNT_BUCKETS, ("route",))
+db_seconds_per_request = Histogram("db_duration_per_request_seconds", "Time one request spent in queries", LATENCY_BUCKETS, ("route",))
+n_plus_one_requests = Counter("db_n_plus_one_requests_total", "Requests that repeated one statement N_PLUS_ONE_THRESHOLD times or more", ("route",))
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # statement text -> executions, the text is parameterised so a loop of
+        # single row lookups shows up as one statement with a high count
+        self.statements: dict[str, int] = {}
+
+
+_current_request: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar("request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    db_query_seconds.observe(elapsed)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        stats.statements[statement] = stats.statements.get(statement, 0) + 1
+
+
+def instrument_engine(db_engine: AsyncEngine) -> None:
+    # the sync engine events run inside the request's task, so the context variable is visible
+    event.listen(db_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(db_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _route(scope) -> str:
+    # the path template ("/users/like/{post_id}") keeps the label cardinality bounded
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app, n_plus_one_threshold: int = 10, slow_request_seconds: float = 1.0):
+        self.app = app
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_request.reset(token)
+            self._record(scope, status_code, elapsed, stats)
+
+    def _record(self, scope, status_code: int, elapsed: float, stats: RequestStats) -> None:
+        method = scope["method"]
+        route = _route(scope)
+        http_requests.inc(method, route, str(status_code))
+        http_request_seconds.observe(elapsed, method, route)
+        db_queries_per_request.observe(stats.queries, route)
+        db_seconds_per_request.observe(stats.db_seconds, route)
+
+        repeated = [(statement, count) for statement, count in stats.statements.items() if count >= self.n_plus_one_threshold]
+        if repeated:
+            n_plus_one_requests.inc(route)
+            for statement, count in repeated:
+                logger.warning(
+                    "possible N+1 queries",
+                    extra={"method": method, "route": route, "executions": count, "statement": statement[:300]},
+                )
+
+        if elapsed >= self.slow_request_seconds:
+            logger.warning(
+                "slow request",
+                extra={"method": method, "route": route, "status": status_code, "seconds": round(elapsed, 4), "queries": stats.queries, "db_seconds": round(stats.db_seconds, 4)},
+            )
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "request",
+                extra={"method": method, "route": route, "status": status_code, "seconds": round(elapsed, 4), "queries": stats.queries, "db_seconds": round(stats.db_seconds, 4)},
+            )
@@ -0,0 +1,299 @@
+'''
+token bucket rate limiting as a pure ASGI middleware.
+
+it sits in front of the routing so an over limit request is answered with a
+429 before any dependency runs, i.e. before a db session is opened or a
+password is hashed. every policy is a set of limits on one path, each limit
+keyed either by client ip or by the username/email in the json body.
+
+a limit "20/minute" is a bucket of 20 tokens refilled at 20 per minute, so it
+allows bursts of 20 and 20 per minute sustained.
+'''
+import asyncio
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import NamedTuple
+
+from sqlalchemy import Boolean, Column, Float, MetaData, String, Table, case, create_engine, event, literal, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+LIMIT_KEYS = ("ip", "username")
+# login/register payloads are tiny, anything larger is not parsed for a username
+MAX_BODY_BYTES = 16 * 1024
+
+
+class Limit(NamedTuple):
+    key: str
+    rate: float
+    burst: int
+
+
+def parse_limit(key: str, spec: str) -> Limit:
+    '''
+    "5/minute" -> Limit(key, rate=5/60, burst=5)
+    '''
+    if key not in LIMIT_KEYS:
+        raise ValueError(f"Unknown rate limit key : {key}, expected one of {LIMIT_KEYS}")
+    try:
+        count, period = spec.split("/")
+        count = int(count)
+        seconds = PERIODS[period.strip().rstrip("s")]
+    except (ValueError, KeyError) as e:
+        raise ValueError(f"Invalid rate limit : {spec}, expected <count>/<second|minute|hour|day>") from e
+    return Limit(key=key, rate=count / seconds, burst=count)
+
+
+def parse_policies(policies: dict[str, dict[str, str]]) -> dict[str, list[Limit]]:
+    return {path: [parse_limit(key, spec) for key, spec in limits.items()] for path, limits in policies.items()}
+
+
+class RateLimitBackend(ABC):
+    # True when hit() does blocking io and has to run off the event loop
+    blocking = False
+
+    def __init__(self):
+        # requests let through / turned away by the middleware in this worker
+        self.allowed = 0
+        self.limited = 0
+
+    @abstractmethod
+    def hit(self, key: str, rate: float, burst: int, cost: float = 1.0) -> tuple[bool, float]:
+        '''
+        takes `cost` tokens from the bucket `key`, returns (allowed, retry_after seconds)
+        '''
+
+    @abstractmethod
+    def refund(self, key: str, rate: float, burst: int, cost: float = 1.0) -> None:
+        '''
+        gives back `cost` tokens taken by hit(), capped at `burst`
+        '''
+
+    def stats(self) -> dict:
+        return {"allowed": self.allowed, "limited": self.limited}
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    '''
+    per process buckets, each worker enforces the limits on its own share of
+    the traffic. the least recently used buckets are dropped past `max_keys`,
+    a dropped bucket simply starts full again.
+    '''
+
+    def __init__(self, max_keys: int = 100_000):
+        super().__init__()
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, rate: float, burst: int, cost: float = 1.0) -> tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def refund(self, key: str, rate: float, burst: int, cost: float = 1.0) -> None:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return
+            tokens, updated = bucket
+            self._buckets[key] = (min(burst, tokens + (now - updated) * rate + cost), now)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "buckets": len(self._buckets)}
+
+
+metadata = MetaData()
+
+rate_limit_buckets = Table(
+    "rate_limit_buckets",
+    metadata,
+    Column("key", String(320), primary_key=True),
+    Column("tokens", Float, nullable=False),
+    Column("updated_at", Float, nullable=False),
+    Column("allowed", Boolean, nullable=False),
+)
+
+
+class SQLRateLimitBackend(RateLimitBackend):
+    '''
+    buckets shared by every worker, in a local sqlite file
+    (sqlite:///./rate_limits.db) or a postgres table. refill, check and take
+    happen in one upsert so concurrent workers can't both spend the last token.
+    '''
+    blocking = True
+
+    def __init__(self, url: str):
+        super().__init__()
+        connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+        self.engine = create_engine(url, connect_args=connect_args)
+        if url.startswith("sqlite"):
+            event.listen(self.engine, "connect", _sqlite_wal)
+        self._insert = postgresql.insert if self.engine.dialect.name == "postgresql" else sqlite.insert
+        metadata.create_all(self.engine)
+
+    def hit(self, key: str, rate: float, burst: int, cost: float = 1.0) -> tuple[bool, float]:
+        now = time.time()
+        table = rate_limit_buckets
+        refilled = table.c.tokens + (literal(now) - table.c.updated_at) * literal(rate)
+        refilled = case((refilled > literal(burst), literal(float(burst))), else_=refilled)
+        statement = self._insert(table).values(key=key, tokens=burst - cost, updated_at=now, allowed=True)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.key],
+            set_={
+                "tokens": case((refilled >= literal(cost), refilled - literal(cost)), else_=refilled),
+                "allowed": refilled >= literal(cost),
+                "updated_at": literal(now),
+            },
+        ).returning(table.c.tokens, table.c.allowed)
+        with self.engine.begin() as conn:
+            tokens, allowed = conn.execute(statement).one()
+        return bool(allowed), 0.0 if allowed else (cost - tokens) / rate
+
+    def refund(self, key: str, rate: float, burst: int, cost: float = 1.0) -> None:
+        now = time.time()
+        table = rate_limit_buckets
+        refilled = table.c.tokens + (literal(now) - table.c.updated_at) * literal(rate) + literal(cost)
+        statement = (
+            update(table)
+            .where(table.c.key == key)
+            .values(
+                tokens=case((refilled > literal(burst), literal(float(burst))), else_=refilled),
+                updated_at=literal(now),
+            )
+        )
+        with self.engine.begin() as conn:
+            conn.execute(statement)
+
+
+def _sqlite_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def build_rate_limit_backend(backend: str, url: str | None = None) -> RateLimitBackend:
+    if backend == "memory":
+        return InMemoryRateLimitBackend()
+    if backend == "sql":
+        if not url:
+            raise ValueError("RATE_LIMIT_URL is required for the sql rate limit backend")
+        return SQLRateLimitBackend(url)
+    raise ValueError(f"Unknown rate limit backend : {backend}")
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, backend: RateLimitBackend, policies: dict[str, list[Limit]], trust_forwarded: bool = False):
+        self.app = app
+        self.backend = backend
+        self.policies = policies
+        self.trust_forwarded = trust_forwarded
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+        limits = self.policies.get(scope["path"])
+        if not limits:
+            return await self.app(scope, receive, send)
+
+        keys = {"ip": self._client_ip(scope)}
+        if any(limit.key == "username" for limit in limits):
+            body, receive = await self._buffer_body(receive)
+            keys["username"] = _username(body)
+
+        retry_after = 0.0
+        taken = []
+        for index, limit in enumerate(limits):
+            value = keys.get(limit.key)
+            if not value:
+                continue
+            bucket = f"{scope['path']}:{index}:{limit.key}:{value}"
+            allowed, wait = await self._call(self.backend.hit, bucket, limit.rate, limit.burst)
+            if allowed:
+                taken.append((bucket, limit))
+            else:
+                retry_after = max(retry_after, wait)
+
+        if retry_after:
+            # a rejected request costs nothing, give back what the other limits took
+            # so e.g. a throttled ip doesn't also drain the username bucket it targets
+            for bucket, limit in taken:
+                await self._call(self.backend.refund, bucket, limit.rate, limit.burst)
+            self.backend.limited += 1
+            return await _too_many_requests(send, retry_after)
+        self.backend.allowed += 1
+        return await self.app(scope, receive, send)
+
+    async def _call(self, method, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def _client_ip(self, scope) -> str | None:
+        if self.trust_forwarded:
+            for name, value in scope.get("headers", []):
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else None
+
+    async def _buffer_body(self, receive):
+        '''
+        reads the request body up front and returns it with a receive that
+        replays it to the app
+        '''
+        messages = []
+        size = 0
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            size += len(message.get("body", b""))
+            if not message.get("more_body", False) or size > MAX_BODY_BYTES:
+                break
+        body = b"".join(message.get("body", b"") for message in messages) if size <= MAX_BODY_BYTES else b""
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        return body, replay
+
+
+def _username(body: bytes) -> str | None:
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    value = data.get("username") or data.get("email")
+    return value.strip().lower() if isinstance(value, str) and value.strip() else None
+
+
+async def _too_many_requests(send, retry_after: float) -> None:
+    body = json.dumps({"detail": "Too many requests, please retry later"}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, int(retry_after + 0.999))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
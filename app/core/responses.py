@@ -0,0 +1,82 @@
+'''
+fast response serialization.
+
+the default path validates every row into a schema, dumps it to a dict, lets
+FastAPI validate the envelope against response_model again and finally runs
+json.dumps. for listings page_response validates the rows once through a
+precompiled TypeAdapter and lets pydantic-core write the JSON bytes directly,
+FastAPI sends those bytes untouched.
+'''
+import functools
+from typing import Any, Generic, TypeVar
+
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, TypeAdapter
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+T = TypeVar("T")
+
+
+class PageResponse(BaseModel, Generic[T]):
+    '''
+    same wire format as ResponseSchema but with a typed data_list
+    '''
+    message: str
+    status: str
+    status_code: int
+    data_dict: dict | None = None
+    data_list: list[T] | None = None
+    pagination_data: dict | None = None
+
+
+class FastJSONResponse(JSONResponse):
+    '''
+    JSONResponse rendered with orjson when it is installed
+    '''
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class RawJSONResponse(Response):
+    '''
+    body is already serialized JSON bytes
+    '''
+    media_type = "application/json"
+
+
+@functools.lru_cache(maxsize=None)
+def page_adapter(schema: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(PageResponse[schema])
+
+
+def page_response(
+    schema: type[BaseModel],
+    rows: list,
+    message: str,
+    status: str = "success",
+    status_code: int = 200,
+    pagination_data: dict | None = None,
+) -> RawJSONResponse:
+    '''
+    rows can be ORM objects, Row tuples or dicts, they are validated straight
+    into `schema` and written to bytes in one pass
+    '''
+    adapter = page_adapter(schema)
+    page = adapter.validate_python(
+        {
+            "message": message,
+            "status": status,
+            "status_code": status_code,
+            "data_list": rows,
+            "pagination_data": pagination_data,
+        },
+        from_attributes=True,
+    )
+    return RawJSONResponse(content=adapter.dump_json(page), status_code=status_code)
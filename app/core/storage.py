@@ -0,0 +1,97 @@
+'''
+local object store for uploaded media.
+
+objects live under MEDIA_ROOT at <key[:2]>/<key[2:4]>/<key>. an upload in
+progress is the file <key>.part and only appears under the final name once it
+is complete, so readers never see a half written object. the size of the
+.part file is the upload offset, a client that lost its connection asks for it
+and resumes from there.
+'''
+import asyncio
+import fcntl
+import os
+from pathlib import Path
+
+
+class UploadConflict(Exception):
+    '''
+    the chunk does not start at the current offset, or another request is
+    writing to the same upload right now
+    '''
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class LocalObjectStore:
+    def __init__(self, root: str):
+        self.root = Path(root).resolve()
+
+    def relative_path(self, key: str) -> str:
+        if not key.isalnum():
+            raise ValueError(f"InvalidMediaKey : {key}")
+        return f"{key[:2]}/{key[2:4]}/{key}"
+
+    def path(self, key: str) -> Path:
+        return self.root / self.relative_path(key)
+
+    def part_path(self, key: str) -> Path:
+        path = self.path(key)
+        return path.with_name(path.name + ".part")
+
+    def offset(self, key: str) -> int:
+        try:
+            return self.part_path(key).stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def exists(self, key: str) -> bool:
+        return self.path(key).is_file()
+
+    async def append(self, key: str, offset: int, chunks, max_size: int) -> int:
+        '''
+        writes the async iterable of byte `chunks` to the upload at `offset`,
+        one chunk in memory at a time. returns the new offset.
+        '''
+        part = self.part_path(key)
+        await asyncio.to_thread(part.parent.mkdir, parents=True, exist_ok=True)
+        f = await asyncio.to_thread(open, part, "ab")
+        try:
+            try:
+                # per upload writer lock across workers, dropped by the kernel if the process dies
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError as e:
+                raise UploadConflict("upload is being written by another request") from e
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise UploadConflict(f"offset mismatch, upload is at {current}")
+            written = current
+            try:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    written += len(chunk)
+                    if written > max_size:
+                        raise UploadTooLarge(f"upload exceeds its declared size of {max_size} bytes")
+                    await asyncio.to_thread(f.write, chunk)
+            except UploadTooLarge:
+                # drop the whole chunk request, the client resumes from `current`
+                await asyncio.to_thread(f.truncate, current)
+                raise
+            await asyncio.to_thread(f.flush)
+            return os.fstat(f.fileno()).st_size
+        finally:
+            await asyncio.to_thread(f.close)
+
+    async def complete(self, key: str) -> Path:
+        path = self.path(key)
+        await asyncio.to_thread(os.replace, self.part_path(key), path)
+        return path
+
+    def remove(self, key: str) -> None:
+        '''
+        deletes the object and any unfinished upload of it, missing files are fine
+        '''
+        self.path(key).unlink(missing_ok=True)
+        self.part_path(key).unlink(missing_ok=True)
@@ -0,0 +1,74 @@
+'''
+blocking. the block sets of a user are loaded with one query and cached, list
+queries then exclude the hidden authors with a single NOT IN filter instead of
+checking every row.
+'''
+from uuid import UUID
+
+from sqlalchemy import delete, literal, select, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import read_only
+from app.users.cache import BlockSets, block_cache
+from app.users.models import BlockedUser, User
+
+
+class BlockHandler:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def block(self, blocker_id: UUID, blocked_id: UUID) -> bool:
+        if str(blocker_id) == str(blocked_id):
+            raise ValueError("InvalidBlock : you can't block yourself")
+        # a missing user would otherwise only show up as an IntegrityError from the insert
+        blocked = await self.session.execute(select(User.id).where(User.id == blocked_id))
+        if blocked.scalar_one_or_none() is None:
+            raise LookupError(f"UserNotFound : {blocked_id}")
+        result = await self.session.execute(
+            insert(BlockedUser)
+            .values(BlockedUser(blocker_id=blocker_id, blocked_id=blocked_id).model_dump())
+            .on_conflict_do_nothing()
+        )
+        await self.session.commit()
+        self._invalidate(blocker_id, blocked_id)
+        return bool(result.rowcount)
+
+    async def unblock(self, blocker_id: UUID, blocked_id: UUID) -> bool:
+        result = await self.session.execute(
+            delete(BlockedUser).where(BlockedUser.blocker_id == blocker_id, BlockedUser.blocked_id == blocked_id)
+        )
+        await self.session.commit()
+        self._invalidate(blocker_id, blocked_id)
+        return bool(result.rowcount)
+
+    def _invalidate(self, *user_ids) -> None:
+        for user_id in user_ids:
+            block_cache.invalidate(str(user_id))
+
+    @read_only
+    async def block_sets(self, user_id: UUID) -> BlockSets:
+        key = str(user_id)
+        sets = block_cache.get(key)
+        if sets is not None:
+            return sets
+        statement = union_all(
+            select(BlockedUser.blocked_id.label("other_id"), literal(True).label("by_me")).where(BlockedUser.blocker_id == user_id),
+            select(BlockedUser.blocker_id, literal(False)).where(BlockedUser.blocked_id == user_id),
+        )
+        rows = (await self.session.execute(statement)).all()
+        blocked = frozenset(row.other_id for row in rows if row.by_me)
+        blocked_by = frozenset(row.other_id for row in rows if not row.by_me)
+        sets = BlockSets(blocked=blocked, blocked_by=blocked_by, hidden=blocked | blocked_by)
+        block_cache.set(key, sets)
+        return sets
+
+    async def hidden_user_ids(self, user_id: UUID) -> frozenset:
+        return (await self.block_sets(user_id)).hidden
+
+    async def can_see(self, viewer_id: UUID, user_ids: list) -> dict[UUID, bool]:
+        '''
+        batch "can the viewer see these users' content"
+        '''
+        hidden = await self.hidden_user_ids(viewer_id)
+        return {UUID(str(user_id)): UUID(str(user_id)) not in hidden for user_id in user_ids}
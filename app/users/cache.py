@@ -0,0 +1,52 @@
+'''
+process wide caches for user and post state
+'''
+from typing import NamedTuple
+
+from app.core.cache import LoadingCache, TTLCache
+from config import settings
+
+
+class UserStatus(NamedTuple):
+    is_active: bool
+    is_banned: bool
+
+
+class BlockSets(NamedTuple):
+    blocked: frozenset
+    blocked_by: frozenset
+    # blocked | blocked_by, the users whose content is hidden from this user
+    hidden: frozenset
+
+
+# user_id (str) -> UserStatus, read by decode_jwt on every authenticated request
+user_status_cache = TTLCache(
+    maxsize=settings.USER_STATUS_CACHE_SIZE,
+    ttl=settings.USER_STATUS_CACHE_TTL,
+)
+
+
+# user_id (str) -> read only {post_id: liked}, only the posts that user has been
+# shown, kept current by like/unlike so feed rendering can skip the lookup query.
+# entries are replaced, never changed in place
+like_cache = TTLCache(
+    maxsize=settings.LIKE_CACHE_USERS,
+    ttl=settings.LIKE_CACHE_TTL,
+)
+
+
+# user_id (str) -> BlockSets, cleared for both users on block/unblock in this
+# worker, other workers pick the change up within BLOCK_CACHE_TTL
+block_cache = TTLCache(
+    maxsize=settings.BLOCK_CACHE_USERS,
+    ttl=settings.BLOCK_CACHE_TTL,
+)
+
+
+# post_id (str) -> PostFetchSchema row of a live post, without the counter
+# deltas still in counter_buffer. dropped in this worker on update, soft delete
+# and counter flush, other workers see changes within POST_CACHE_TTL
+post_cache = LoadingCache(
+    maxsize=settings.POST_CACHE_SIZE,
+    ttl=settings.POST_CACHE_TTL,
+)
@@ -0,0 +1,148 @@
+'''
+write coalescing for the denormalised counters on Post and Comment.
+
+handlers only bump an in-memory delta, a background task folds all deltas
+collected during FLUSH_INTERVAL into one UPDATE ... FROM (VALUES ...) per table,
+so a hot post is written once per interval instead of once per like.
+'''
+import asyncio
+import logging
+from collections import defaultdict
+from uuid import UUID
+
+from sqlalchemy import Integer, Uuid, column, update, values
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.core.database import async_session_maker
+from app.users.cache import post_cache
+from app.users.models import Comment, Post
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = {
+    Post: ("likes_count", "comments_count", "views_count", "share_count"),
+    Comment: ("likes_count",),
+}
+
+
+class CounterBuffer:
+    def __init__(self, interval: float):
+        self.interval = interval
+        # model -> row id -> field -> delta
+        self._pending: dict = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+        # deltas handed to a flush that has not committed yet, still merged into reads
+        self._in_flight: dict = {}
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.failures = 0
+
+    def incr(self, model, row_id: UUID, field: str, delta: int = 1) -> None:
+        if field not in COUNTER_FIELDS[model]:
+            raise ValueError(f"{model.__name__}.{field} is not a buffered counter")
+        self._pending[model][UUID(str(row_id))][field] += delta
+
+    def pending(self, model, row_id: UUID) -> dict[str, int]:
+        row_id = UUID(str(row_id))
+        merged: dict[str, int] = defaultdict(int)
+        for source in (self._in_flight, self._pending):
+            for field, delta in source.get(model, {}).get(row_id, {}).items():
+                merged[field] += delta
+        return merged
+
+    def merge_into(self, rows: list) -> list:
+        '''
+        add the not yet flushed deltas to loaded Post/Comment rows without
+        marking them dirty in the session
+        '''
+        for row in rows:
+            for field, delta in self.pending(type(row), row.id).items():
+                if delta:
+                    set_committed_value(row, field, getattr(row, field) + delta)
+        return rows
+
+    def _statement(self, model, rows: dict):
+        fields = COUNTER_FIELDS[model]
+        table = model.__table__
+        deltas = values(
+            column("id", Uuid),
+            *(column(field, Integer) for field in fields),
+            name="deltas",
+        ).data([
+            (row_id, *(row.get(field, 0) for field in fields))
+            # fixed order keeps concurrent workers from deadlocking on row locks
+            for row_id, row in sorted(rows.items())
+        ])
+        return (
+            update(table)
+            .where(table.c.id == deltas.c.id)
+            .values({field: table.c[field] + deltas.c[field] for field in fields})
+        )
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._pending:
+                return 0
+            self._in_flight, self._pending = self._pending, defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+            try:
+                async with async_session_maker() as session:
+                    for model, rows in self._in_flight.items():
+                        await session.execute(self._statement(model, rows))
+                    await session.commit()
+                # cached posts don't hold these deltas, and they are about to leave _in_flight
+                for post_id in self._in_flight.get(Post, {}):
+                    post_cache.invalidate(str(post_id))
+            except Exception:
+                self.failures += 1
+                # keep the deltas for the next attempt
+                for model, rows in self._in_flight.items():
+                    for row_id, fields in rows.items():
+                        for field, delta in fields.items():
+                            self._pending[model][row_id][field] += delta
+                raise
+            finally:
+                flushed = sum(len(rows) for rows in self._in_flight.values())
+                self._in_flight = {}
+            self.flushes += 1
+            self.rows_flushed += flushed
+            return flushed
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("counter flush failed")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # drain whatever is left before the process goes away. a failure is
+        # logged, raising here would skip the rest of the shutdown
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("final counter flush failed")
+
+    def stats(self) -> dict:
+        return {
+            "pending_rows": sum(len(rows) for rows in self._pending.values()),
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "failures": self.failures,
+        }
+
+
+counter_buffer = CounterBuffer(interval=settings.COUNTER_FLUSH_INTERVAL)
@@ -0,0 +1,107 @@
+'''
+row counts with a selectable cost/accuracy trade-off.
+
+exact     -> SELECT count(*), a scan of every matching row
+cached    -> exact, but reused for COUNT_CACHE_TTL seconds per (table, filters)
+estimated -> no scan: the maintained Post.likes_count/comments_count counters
+             when they answer the question, otherwise the planner's row
+             estimate (pg_class.reltuples unfiltered, EXPLAIN filtered)
+'''
+import json
+from typing import NamedTuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import TTLCache
+from app.users.counters import counter_buffer
+from app.users.models import Comment, Post, PostLike
+from config import settings
+
+COUNT_MODES = ("exact", "cached", "estimated")
+
+# (model, filtered column) -> counter on Post that already holds that count
+MAINTAINED_COUNTERS = {
+    (Comment, "post_id"): "comments_count",
+    (PostLike, "post_id"): "likes_count",
+}
+
+count_cache = TTLCache(maxsize=settings.COUNT_CACHE_SIZE, ttl=settings.COUNT_CACHE_TTL)
+
+
+class CountResult(NamedTuple):
+    value: int
+    approximate: bool
+    mode: str
+
+
+class CountService:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def count(self, model, filters: dict | None = None, mode: str = "exact") -> CountResult:
+        if mode not in COUNT_MODES:
+            raise ValueError(f"InvalidCountMode : {mode}, expected one of {COUNT_MODES}")
+        filters = {name: value for name, value in (filters or {}).items() if name in model.__table__.c}
+
+        if mode == "cached":
+            key = (model.__tablename__, tuple(sorted((name, str(value)) for name, value in filters.items())))
+            value = count_cache.get(key)
+            if value is not None:
+                return CountResult(value, True, mode)
+            value = await self._exact(model, filters)
+            count_cache.set(key, value)
+            return CountResult(value, False, mode)
+
+        if mode == "estimated":
+            value = await self._estimated(model, filters)
+            if value is not None:
+                return CountResult(value, True, mode)
+
+        return CountResult(await self._exact(model, filters), False, "exact")
+
+    def _statement(self, model, filters: dict):
+        statement = select(func.count()).select_from(model)
+        for name, value in filters.items():
+            statement = statement.where(getattr(model, name) == value)
+        return statement
+
+    async def _exact(self, model, filters: dict) -> int:
+        result = await self.session.execute(self._statement(model, filters))
+        return result.scalar_one()
+
+    async def _estimated(self, model, filters: dict) -> int | None:
+        if len(filters) == 1:
+            (name, value), = filters.items()
+            counter = MAINTAINED_COUNTERS.get((model, name))
+            if counter:
+                result = await self.session.execute(select(getattr(Post, counter)).where(Post.id == value))
+                stored = result.scalar_one_or_none()
+                if stored is not None:
+                    return stored + counter_buffer.pending(Post, value).get(counter, 0)
+
+        if self.session.get_bind().dialect.name != "postgresql":
+            return None
+
+        if not filters:
+            result = await self.session.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                {"table": model.__tablename__},
+            )
+            estimate = result.scalar_one_or_none()
+            # -1 until the table has been vacuumed/analyzed once
+            return estimate if estimate is not None and estimate >= 0 else None
+
+        statement = select(model.id)
+        for name, value in filters.items():
+            statement = statement.where(getattr(model, name) == value)
+        if hasattr(model, "is_delete"):
+            # compiled by hand below, so the session's soft delete criteria never see it
+            statement = statement.where(model.is_delete.is_(None))
+        compiled = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+        result = await self.session.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}"))
+        plan = result.scalar_one()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
@@ -1,13 +1,50 @@
-from sqlmodel import select, func
+from datetime import datetime
+from types import MappingProxyType
+from sqlmodel import select
 from typing import Optional
+from uuid import UUID
 from .models import User, Post, Comment, PostLike
 from app.users.schemas import (
     CreateUserSchema, UserSchema, PostCreateSchema,
-    CommentCreateSchema, PostLikeSchema
+    CommentCreateSchema, PostLikeSchema, PostFetchSchema
 )
-from sqlalchemy.sql.elements import BinaryExpression
-from sqlalchemy import and_
+from sqlalchemy import insert, delete, func, or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.users.helpers import chunked
+from app.users.repository import BaseRepository
+from app.users.cache import UserStatus, user_status_cache, like_cache, post_cache
+from app.core.database import async_session_maker, read_only
+from app.users.counters import counter_buffer
+from app.users.timeline import TimelineHandler
+from config import settings
+
+
+async def bulk_insert(session: AsyncSession, model, rows: list, ignore_conflicts: bool = False) -> list:
+    '''
+    insert many rows with one multi-row INSERT ... RETURNING per chunk instead of
+    add/commit/refresh per row. the caller commits.
+    with ignore_conflicts rows hitting a unique constraint are skipped and only
+    the rows actually inserted are returned.
+    '''
+    created = []
+    values = [row.model_dump() for row in rows]
+    statement = pg_insert(model).on_conflict_do_nothing() if ignore_conflicts else insert(model)
+    for chunk in chunked(values, settings.BULK_INSERT_CHUNK):
+        result = await session.scalars(statement.returning(model), chunk)
+        created.extend(result.all())
+    return created
+
+
+async def require_posts(session: AsyncSession, post_ids: list) -> None:
+    '''
+    raises LookupError unless every post exists and is not soft deleted, an
+    insert referencing them would only fail on a missing post, as an IntegrityError
+    '''
+    post_ids = {UUID(str(post_id)) for post_id in post_ids}
+    found = set((await session.execute(select(Post.id).where(Post.id.in_(post_ids)))).scalars().all())
+    if found != post_ids:
+        raise LookupError(f"PostNotFound : {', '.join(sorted(str(post_id) for post_id in post_ids - found))}")
 
 
 class UserServiceHandler:
@@ -15,12 +52,31 @@ class UserServiceHandler:
         self.session = session
         self.blacklist_token = set()  # In-memory blacklist for simplicity
 
+    @read_only
     async def get_user_by_id(self, user_id: str) -> Optional[UserSchema]:
         statement = select(User).where(User.id == user_id)
         result = await self.session.execute(statement)
         user = result.scalars().first()
         return UserSchema.model_validate(user) if user else None
     
+    async def get_user_status(self, user_id: str) -> Optional[UserStatus]:
+        '''
+        is_active/is_banned for a user, served from user_status_cache when possible
+        '''
+        key = str(user_id)
+        status = user_status_cache.get(key)
+        if status is not None:
+            return status
+        statement = select(User.is_active, User.is_banned).where(User.id == user_id)
+        result = await self.session.execute(statement)
+        row = result.first()
+        if not row:
+            return None
+        status = UserStatus(is_active=row.is_active, is_banned=row.is_banned)
+        user_status_cache.set(key, status)
+        return status
+
+    @read_only
     async def get_user_by_username(self, user_name: str) -> Optional[UserSchema]:
         statement = select(User).where(User.username == user_name)
         result = await self.session.execute(statement)
@@ -34,24 +90,83 @@ class UserServiceHandler:
         await self.session.refresh(new_user)
         return UserSchema.model_validate(new_user)
 
+    async def create_many(self, users_data: list[CreateUserSchema]) -> list[UserSchema]:
+        '''
+        passwords must already be hashed, one INSERT ... RETURNING per chunk
+        '''
+        users = await bulk_insert(self.session, User, [User(**user.model_dump()) for user in users_data])
+        await self.session.commit()
+        return [UserSchema.model_validate(user) for user in users]
+
     async def update_user(self, user_id: str, update_data: dict) -> Optional[UserSchema]:
         user = await self.session.get(User, user_id)
         if user:
             for key, value in update_data.items():
                 setattr(user, key, value)
             await self.session.commit()
+            user_status_cache.invalidate(str(user_id))
             await self.session.refresh(user)
             return UserSchema.model_validate(user)
         return None
 
+    async def ban_user(self, user_id: str) -> Optional[UserSchema]:
+        return await self.update_user(user_id=user_id, update_data={"is_banned": True, "is_active": False})
+
     async def delete_user(self, user_id: str) -> bool:
+        '''
+        soft delete of the user with their posts and comments, all of it is
+        hard deleted by app/users/purge.py once the retention window has passed.
+        the user's likes are hard deleted right away. they and the comments the
+        user left on other posts stop counting here, the purge does not touch
+        those counters again
+        '''
         user = await self.session.get(User, user_id)
         if user:
-            await self.session.delete(user)
+            now = datetime.now()
+            user.is_delete = True
+            user.is_active = False
+            user.deleted_at = user.updated_at = now
+            deleted_post_ids = (await self.session.execute(
+                update(Post)
+                .where(Post.author_id == user.id, Post.is_delete.is_(None))
+                .values(is_delete=True, deleted_at=now, updated_at=now)
+                .returning(Post.id)
+                .execution_options(synchronize_session=False)
+            )).scalars().all()
+            # likes have no soft delete, they go now so an exact count of
+            # post_likes keeps agreeing with likes_count
+            unliked = (await self.session.execute(
+                delete(PostLike).where(PostLike.user_id == user.id).returning(PostLike.post_id)
+            )).scalars().all()
+            # the posts just deleted are already hidden here, their counters no longer matter
+            uncommented = (await self.session.execute(
+                select(Comment.post_id, func.count())
+                .join(Post, Post.id == Comment.post_id)
+                .where(Comment.author_id == user.id)
+                .group_by(Comment.post_id)
+            )).all()
+            # the user's comments and whatever others wrote under the user's posts
+            await self.session.execute(
+                update(Comment)
+                .where(
+                    or_(Comment.author_id == user.id, Comment.post_id.in_(select(Post.id).where(Post.author_id == user.id))),
+                    Comment.is_delete.is_(None),
+                )
+                .values(is_delete=True, deleted_at=now, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
             await self.session.commit()
+            user_status_cache.invalidate(str(user_id))
+            for post_id in deleted_post_ids:
+                post_cache.invalidate(str(post_id))
+            for post_id in unliked:
+                counter_buffer.incr(Post, post_id, "likes_count", -1)
+            for post_id, count in uncommented:
+                counter_buffer.incr(Post, post_id, "comments_count", -count)
             return True
         return False
 
+    @read_only
     async def get_user_by_email(self, email: str) -> Optional[UserSchema]:
         statement = select(User).where(User.email == email)
         result = await self.session.execute(statement)
@@ -59,41 +174,28 @@ class UserServiceHandler:
         return UserSchema.model_validate(user) if user else None
 
 
-class PostServiceHandler:
-    def __init__(self, session: AsyncSession):
-        self.session = session
-
-    async def filter_by(self, filters: dict, offset: int | None = None, limit: int | None = None) -> list[Post]:
-        conditions: list[BinaryExpression] = []
-        for field_name, value in filters.items():
-            if hasattr(Post, field_name):
-                field = getattr(Post, field_name)
-                conditions.append(field == value)
-
-        statement = select(Post)
-        if conditions:
-            statement = statement.where(and_(*conditions))
-
-        if offset and limit:
-            statement = statement.order_by(Post.created_at.desc()).offset(offset).limit(limit)
-
-        result = await self.session.execute(statement)
-        return result.scalars().all()
+class PostServiceHandler(BaseRepository[Post]):
+    model = Post
+    # lets PostFetchSchema be loaded straight from a projected select
+    column_aliases = {
+        "comment_count": (Post.comments_count, None),
+        "author_username": (User.username, (User, User.id == Post.author_id)),
+    }
 
     async def create(self, post_data: PostCreateSchema) -> Post:
         post = Post(**post_data.model_dump())
         self.session.add(post)
+        # the post and its fan-out job commit together, the fan-out itself runs off the request
+        TimelineHandler(self.session).enqueue_fan_out([post])
         await self.session.commit()
         await self.session.refresh(post)
         return post
 
-    async def get_all(self) -> list[Post]:
-        result = await self.session.execute(select(Post))
-        return result.scalars().all()
-
-    async def count(self) -> int:
-        result = await self.session.execute(select(func.count()).select_from(Post))
-        return result.scalar_one()
+    async def create_many(self, posts_data: list[PostCreateSchema]) -> list[Post]:
+        posts = await bulk_insert(self.session, Post, [Post(**post.model_dump()) for post in posts_data])
+        TimelineHandler(self.session).enqueue_fan_out(posts)
+        await self.session.commit()
+        return posts
 
     async def update(self, post_id: str, update_data: dict) -> Optional[Post]:
         post = await self.session.get(Post, post_id)
@@ -101,46 +203,95 @@ class PostServiceHandler:
             for key, value in update_data.items():
                 setattr(post, key, value)
             await self.session.commit()
+            post_cache.invalidate(str(post_id))
             await self.session.refresh(post)
             return post
         return None
 
+    async def get_post(self, post_id: UUID):
+        '''
+        PostFetchSchema row of a live post or None, served from post_cache.
+        concurrent misses on the same post share one query.
+        '''
+        row = await post_cache.get_or_load(str(post_id), lambda: self._load_post(post_id))
+        if row is None:
+            return None
+        # counter deltas are merged per read, the cached row leaves them out
+        return self._merge_counters([row])[0]
+
+    @classmethod
+    async def _load_post(cls, post_id: UUID):
+        # own session, the load outlives any one of the requests waiting for it.
+        # primary on purpose, a lagging replica would put a row that predates
+        # the invalidating write back into the cache
+        async with async_session_maker() as session:
+            statement = cls(session)._statement(("id",), PostFetchSchema, False, False)
+            result = await session.execute(statement, {"f_id": post_id})
+            return result.first()
+
+    async def soft_delete(self, post_id: UUID, author_id: UUID) -> bool:
+        '''
+        false when the post does not exist, is already deleted or is not `author_id`'s.
+        the comments under the post, also other users', are soft deleted with it
+        '''
+        now = datetime.now()
+        result = await self.session.execute(
+            update(Post)
+            .where(Post.id == post_id, Post.author_id == author_id, Post.is_delete.is_(None))
+            .values(is_delete=True, deleted_at=now, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            await self.session.execute(
+                update(Comment)
+                .where(Comment.post_id == post_id, Comment.is_delete.is_(None))
+                .values(is_delete=True, deleted_at=now, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+        await self.session.commit()
+        post_cache.invalidate(str(post_id))
+        return bool(result.rowcount)
 
-class CommentServiceHandler:
-    def __init__(self, session: AsyncSession):
-        self.session = session
-
-    async def filter_by(self, filters: dict, offset: int | None = None, limit: int | None = None) -> list[Comment]:
-        conditions: list[BinaryExpression] = []
-        for field_name, value in filters.items():
-            if hasattr(Comment, field_name):
-                field = getattr(Comment, field_name)
-                conditions.append(field == value)
-
-        statement = select(Comment)
-        if conditions:
-            statement = statement.where(and_(*conditions))
-
-        if offset and limit:
-            statement = statement.order_by(Comment.created_at.desc()).offset(offset).limit(limit)
-
-        result = await self.session.execute(statement)
-        return result.scalars().all()
 
-    async def get_all(self) -> list[Comment]:
-        result = await self.session.execute(select(Comment))
-        return result.scalars().all()
+class CommentServiceHandler(BaseRepository[Comment]):
+    model = Comment
 
     async def create(self, comment_data: CommentCreateSchema) -> Comment:
+        await self._require_targets([comment_data])
         comment = Comment(**comment_data.model_dump())
         self.session.add(comment)
         await self.session.commit()
         await self.session.refresh(comment)
+        counter_buffer.incr(Post, comment.post_id, "comments_count")
         return comment
 
-    async def count(self) -> int:
-        result = await self.session.execute(select(func.count()).select_from(Comment))
-        return result.scalar_one()
+    async def create_many(self, comments_data: list[CommentCreateSchema]) -> list[Comment]:
+        await self._require_targets(comments_data)
+        comments = await bulk_insert(self.session, Comment, [Comment(**comment.model_dump()) for comment in comments_data])
+        await self.session.commit()
+        for comment in comments:
+            counter_buffer.incr(Post, comment.post_id, "comments_count")
+        return comments
+
+    async def _require_targets(self, comments_data: list[CommentCreateSchema]) -> None:
+        '''
+        every post has to be live and every reply_to_id a live comment on the
+        same post. LookupError for a missing post or comment, ValueError for a
+        reply to a comment on another post
+        '''
+        await require_posts(self.session, [comment.post_id for comment in comments_data])
+        reply_to_ids = {comment.reply_to_id for comment in comments_data if comment.reply_to_id}
+        if not reply_to_ids:
+            return
+        parents = dict((await self.session.execute(
+            select(Comment.id, Comment.post_id).where(Comment.id.in_(reply_to_ids))
+        )).all())
+        missing = reply_to_ids - parents.keys()
+        if missing:
+            raise LookupError(f"CommentNotFound : {', '.join(sorted(str(comment_id) for comment_id in missing))}")
+        for comment in comments_data:
+            if comment.reply_to_id and parents[comment.reply_to_id] != comment.post_id:
+                raise ValueError(f"InvalidComment : {comment.reply_to_id} is not a comment on post {comment.post_id}")
 
     async def update(self, comment_id: str, update_data: dict) -> Optional[Comment]:
         comment = await self.session.get(Comment, comment_id)
@@ -153,38 +304,78 @@ class CommentServiceHandler:
         return None
 
 
-class PostLikeHandler:
-    def __init__(self, session: AsyncSession):
-        self.session = session
-
-    async def filter_by(self, filters: dict, offset: int | None = None, limit: int | None = None) -> list[PostLike]:
-        conditions: list[BinaryExpression] = []
-        for field_name, value in filters.items():
-            if hasattr(PostLike, field_name):
-                field = getattr(PostLike, field_name)
-                conditions.append(field == value)
-
-        statement = select(PostLike)
-        if conditions:
-            statement = statement.where(and_(*conditions))
-
-        if offset and limit:
-            statement = statement.order_by(PostLike.created_at.desc()).offset(offset).limit(limit)
-
-        result = await self.session.execute(statement)
-        return result.scalars().all()
-
-    async def get_all(self) -> list[PostLike]:
-        result = await self.session.execute(select(PostLike))
-        return result.scalars().all()
+class PostLikeHandler(BaseRepository[PostLike]):
+    model = PostLike
 
     async def create(self, postlike_data: PostLikeSchema) -> PostLike:
-        pl = PostLike(**postlike_data.model_dump())
-        self.session.add(pl)
+        '''
+        idempotent, liking an already liked post returns the existing like
+        '''
+        await require_posts(self.session, [postlike_data.post_id])
+        created = await bulk_insert(self.session, PostLike, [PostLike(**postlike_data.model_dump())], ignore_conflicts=True)
         await self.session.commit()
-        await self.session.refresh(pl)
-        return pl
-
-    async def count(self) -> int:
-        result = await self.session.execute(select(func.count()).select_from(PostLike))
-        return result.scalar_one()
+        if created:
+            self._liked(created[0].user_id, created[0].post_id, True)
+            return created[0]
+        result = await self.session.execute(
+            select(PostLike).where(
+                PostLike.user_id == postlike_data.user_id,
+                PostLike.post_id == postlike_data.post_id
+            )
+        )
+        return result.scalars().one()
+
+    async def create_many(self, postlikes_data: list[PostLikeSchema]) -> list[PostLike]:
+        '''
+        returns only the likes that did not exist yet
+        '''
+        unique = {(pl.user_id, pl.post_id): pl for pl in postlikes_data}
+        await require_posts(self.session, [pl.post_id for pl in unique.values()])
+        likes = await bulk_insert(self.session, PostLike, [PostLike(**pl.model_dump()) for pl in unique.values()], ignore_conflicts=True)
+        await self.session.commit()
+        for pl in likes:
+            self._liked(pl.user_id, pl.post_id, True)
+        return likes
+
+    async def remove(self, user_id: str, post_id: str) -> bool:
+        result = await self.session.execute(
+            delete(PostLike).where(PostLike.user_id == user_id, PostLike.post_id == post_id)
+        )
+        await self.session.commit()
+        if not result.rowcount:
+            return False
+        self._liked(user_id, post_id, False)
+        return True
+
+    def _liked(self, user_id, post_id, liked: bool) -> None:
+        counter_buffer.incr(Post, post_id, "likes_count", 1 if liked else -1)
+        known = like_cache.get(str(user_id))
+        if known is not None:
+            # cached maps are read only, readers may hold on to the old one
+            like_cache.set(str(user_id), MappingProxyType({**known, UUID(str(post_id)): liked}))
+
+    @read_only
+    async def liked_post_ids(self, user_id: str, post_ids: list) -> set[UUID]:
+        '''
+        which of `post_ids` the user has liked, one IN query for whatever the
+        per user like cache does not already know
+        '''
+        post_ids = {UUID(str(post_id)) for post_id in post_ids}
+        known = like_cache.get(str(user_id)) if settings.LIKE_CACHE_ENABLED else None
+        if known is None:
+            known = {}
+        missing = post_ids - known.keys()
+        if missing:
+            result = await self.session.execute(
+                select(PostLike.post_id).where(PostLike.user_id == user_id, PostLike.post_id.in_(missing))
+            )
+            liked = set(result.scalars().all())
+            fetched = {post_id: post_id in liked for post_id in missing}
+            if settings.LIKE_CACHE_ENABLED:
+                # copy on write, a like/unlike that landed during the query wins over what it read
+                current = like_cache.get(str(user_id)) or {}
+                if len(current) + len(fetched) > settings.LIKE_CACHE_POSTS_PER_USER:
+                    current = {}
+                like_cache.set(str(user_id), MappingProxyType({**fetched, **current}))
+            known = {**known, **fetched}
+        return {post_id for post_id in post_ids if known.get(post_id)}
@@ -0,0 +1,67 @@
+'''
+constant memory NDJSON / CSV export.
+
+rows are read through a server-side cursor in batches and written out batch by
+batch, so memory depends on the batch size and not on the table size. every
+row carries the cursor of its own position, passing the last one received
+back as `cursor` resumes an interrupted export after that row.
+'''
+import csv
+import io
+import json
+
+from pydantic import BaseModel
+
+from app.core.database import async_session_maker
+from app.users.helpers import encode_cursor
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _value(row, name: str):
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+def _dumps(data: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+async def export_rows(handler_class, schema: type[BaseModel], filters: dict, cursor: str | None = None, fmt: str = "ndjson", batch_size: int = 1000):
+    '''
+    async generator of encoded chunks for a StreamingResponse. it opens its own
+    session because the request scoped one is closed before the body is sent.
+    '''
+    fields = list(schema.model_fields)
+    async with async_session_maker() as session:
+        handler = handler_class(session)
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow([*fields, "cursor"])
+            yield buffer.getvalue().encode()
+
+        async for batch in handler.stream(filters, cursor=cursor, schema=schema, batch_size=batch_size):
+            if fmt == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in batch:
+                    data = schema.model_validate(row, from_attributes=True).model_dump(mode="json")
+                    writer.writerow([*(data[name] for name in fields), encode_cursor(_value(row, "created_at"), _value(row, "id"))])
+                yield buffer.getvalue().encode()
+            else:
+                lines = []
+                for row in batch:
+                    data = schema.model_validate(row, from_attributes=True).model_dump(mode="json")
+                    data["cursor"] = encode_cursor(_value(row, "created_at"), _value(row, "id"))
+                    lines.append(_dumps(data))
+                yield b"\n".join(lines) + b"\n"
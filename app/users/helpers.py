@@ -0,0 +1,45 @@
+import base64
+import itertools
+import json
+from datetime import datetime
+from uuid import UUID
+
+
+def encode_cursor(created_at: datetime, row_id: UUID) -> str:
+    '''
+    build an opaque cursor out of the (created_at, id) of the last row of a page
+    '''
+    raw = json.dumps([created_at.isoformat(), str(row_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    '''
+    reverse of encode_cursor, raises ValueError for anything we did not issue
+    '''
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), UUID(row_id)
+    except Exception as e:
+        raise ValueError(f"InvalidCursor : {cursor}") from e
+
+
+def split_page(rows: list, limit: int | None) -> tuple[list, str | None]:
+    '''
+    drop the look-ahead row fetched by the repository and return (page, next_cursor)
+    '''
+    rows = list(rows)
+    if not limit or len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    last = page[-1]
+    if isinstance(last, dict):
+        return page, encode_cursor(last["created_at"], last["id"])
+    return page, encode_cursor(last.created_at, last.id)
+
+
+def chunked(items: list, size: int):
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
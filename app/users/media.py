@@ -0,0 +1,87 @@
+'''
+resumable media uploads.
+
+1. POST  /users/media/uploads/               {"content_type", "size"} -> upload id
+2. PATCH /users/media/uploads/{id}           raw bytes, Upload-Offset header,
+                                             repeat until offset == size
+   GET   /users/media/uploads/{id}           current offset, to resume after a drop
+3. create_post with {"media_upload_id": id}  sets Post.media_url
+
+request bodies are streamed to disk chunk by chunk, nothing holds a whole
+file in memory.
+'''
+from datetime import datetime
+from uuid import UUID, uuid4
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import read_only
+from app.core.storage import LocalObjectStore
+from app.users.models import MediaUpload
+from config import settings
+
+media_store = LocalObjectStore(settings.MEDIA_ROOT)
+
+
+def media_url(upload: MediaUpload) -> str:
+    return f"{settings.MEDIA_URL_PREFIX}{upload.storage_key}"
+
+
+class MediaHandler:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def create_upload(self, owner_id: UUID, content_type: str, size: int) -> MediaUpload:
+        if content_type not in settings.MEDIA_ALLOWED_TYPES:
+            raise ValueError(f"InvalidMedia : content type {content_type} is not allowed")
+        if size <= 0 or size > settings.MEDIA_MAX_BYTES:
+            raise ValueError(f"InvalidMedia : size must be between 1 and {settings.MEDIA_MAX_BYTES} bytes")
+        upload = MediaUpload(owner_id=owner_id, storage_key=uuid4().hex, content_type=content_type, size=size)
+        self.session.add(upload)
+        await self.session.commit()
+        await self.session.refresh(upload)
+        return upload
+
+    async def get_upload(self, upload_id: UUID, owner_id: UUID) -> MediaUpload | None:
+        result = await self.session.execute(
+            select(MediaUpload).where(MediaUpload.id == upload_id, MediaUpload.owner_id == owner_id)
+        )
+        return result.scalars().first()
+
+    @read_only
+    async def get_by_key(self, storage_key: str) -> MediaUpload | None:
+        result = await self.session.execute(
+            select(MediaUpload).where(MediaUpload.storage_key == storage_key, MediaUpload.completed_at.is_not(None))
+        )
+        return result.scalars().first()
+
+    def offset(self, upload: MediaUpload) -> int:
+        if upload.completed_at or media_store.exists(upload.storage_key):
+            return upload.size
+        return media_store.offset(upload.storage_key)
+
+    async def write_chunk(self, upload: MediaUpload, offset: int, chunks) -> int:
+        '''
+        appends the streamed `chunks` at `offset` and finishes the upload once
+        all `size` bytes are in. raises UploadConflict / UploadTooLarge.
+        '''
+        if media_store.exists(upload.storage_key):
+            # the file was moved into place but the commit below never happened
+            new_offset = upload.size
+        else:
+            new_offset = await media_store.append(upload.storage_key, offset, chunks, max_size=upload.size)
+            if new_offset == upload.size:
+                await media_store.complete(upload.storage_key)
+        if new_offset == upload.size and not upload.completed_at:
+            upload.completed_at = datetime.now()
+            upload.updated_at = datetime.now()
+            self.session.add(upload)
+            await self.session.commit()
+        return new_offset
+
+    async def media_url_for(self, upload_id: UUID, owner_id: UUID) -> str:
+        upload = await self.get_upload(upload_id, owner_id)
+        if not upload or not upload.completed_at:
+            raise ValueError("InvalidMedia : upload not found or not complete")
+        return media_url(upload)
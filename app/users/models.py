@@ -1,8 +1,11 @@
 from datetime import datetime
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import DDL, Column, Index, LargeBinary, UniqueConstraint, event, func, literal_column, text
 from typing import Optional, List
 from uuid import UUID, uuid4
 
+from app.core.database import register_soft_delete
+
 
 class AbstractModel(SQLModel):
     id: UUID = Field(default_factory=uuid4, primary_key=True)
@@ -44,9 +47,10 @@ class User(AbstractModel, table=True):
 
 class BlockedUser(AbstractModel, table=True):
     __tablename__ = "blocked_users"
+    __table_args__ = (UniqueConstraint("blocker_id", "blocked_id", name="uq_blocked_users_blocker_blocked"),)
 
     blocker_id: UUID = Field(foreign_key="userprofile.id")
-    blocked_id: UUID = Field(foreign_key="userprofile.id")
+    blocked_id: UUID = Field(foreign_key="userprofile.id", index=True)
 
     blocker: Optional[User] = Relationship(back_populates="blocked_by")
     blocked: Optional[User] = Relationship(back_populates="blocked_user")
@@ -109,9 +113,101 @@ class Comment(AbstractModel, table=True):
 
 class PostLike(AbstractModel, table=True):
     __tablename__ = "post_likes"
+    # one like per user and post, also serves the "which of these posts did I like" lookup
+    __table_args__ = (UniqueConstraint("user_id", "post_id", name="uq_post_likes_user_post"),)
 
     user_id: UUID = Field(foreign_key="userprofile.id")
     post_id: UUID = Field(foreign_key="posts.id")
 
     user: Optional[User] = Relationship(back_populates="liked_posts")
     post: Optional[Post] = Relationship(back_populates="likes")
+
+
+class Follow(AbstractModel, table=True):
+    __tablename__ = "follows"
+    __table_args__ = (UniqueConstraint("follower_id", "followee_id", name="uq_follows_follower_followee"),)
+
+    follower_id: UUID = Field(foreign_key="userprofile.id", index=True)
+    followee_id: UUID = Field(foreign_key="userprofile.id", index=True)
+
+
+class TimelineEntry(SQLModel, table=True):
+    '''
+    precomputed home feed, one row per (reader, post). the primary key doubles
+    as the feed index so reading a page is one range scan on it.
+    '''
+    __tablename__ = "timeline_entries"
+
+    user_id: UUID = Field(foreign_key="userprofile.id", primary_key=True)
+    created_at: datetime = Field(primary_key=True)
+    post_id: UUID = Field(foreign_key="posts.id", primary_key=True)
+    author_id: UUID = Field(foreign_key="userprofile.id")
+
+
+class PostViewSketch(SQLModel, table=True):
+    '''
+    HyperLogLog registers of the viewers of a post (app/users/views.py), merged
+    on every flush. `unique_viewers` is the estimate at the last flush so
+    reading it needs no decoding.
+    '''
+    __tablename__ = "post_view_sketches"
+
+    post_id: UUID = Field(foreign_key="posts.id", primary_key=True)
+    registers: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    unique_viewers: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.now, nullable=False)
+
+
+class MediaUpload(AbstractModel, table=True):
+    '''
+    a chunked upload into the local object store (app/core/storage.py). the
+    bytes received so far are the size of the .part file, not a column, so a
+    crash between writing a chunk and committing can't make them disagree.
+    '''
+    __tablename__ = "media_uploads"
+
+    owner_id: UUID = Field(foreign_key="userprofile.id", index=True)
+    storage_key: str = Field(max_length=64, unique=True)
+    content_type: str = Field(max_length=100)
+    size: int
+    completed_at: datetime | None = Field(default=None)
+
+
+# deleted users, posts and comments are filtered out of every ORM query
+# (app/core/database.py) and purged later by app/users/purge.py
+register_soft_delete(User, Post, Comment)
+
+# only live rows are ever read through these, so the indexes are partial and
+# soft deleted rows cost nothing in them. the predicate has to stay exactly
+# "is_delete IS NULL" for the planner to match it against the queries
+LIVE_ROWS = text("is_delete IS NULL")
+
+# composite indexes backing the keyset (created_at, id) pagination,
+# the column order/direction must match BaseRepository._statement in repository.py
+Index("ix_posts_author_created_id", Post.author_id, Post.created_at.desc(), Post.id.desc(), postgresql_where=LIVE_ROWS)
+Index("ix_comments_post_created_id", Comment.post_id, Comment.created_at.desc(), Comment.id.desc(), postgresql_where=LIVE_ROWS)
+Index("ix_comments_reply_created_id", Comment.reply_to_id, Comment.created_at.desc(), Comment.id.desc(), postgresql_where=LIVE_ROWS)
+Index("ix_post_likes_post_created_id", PostLike.post_id, PostLike.created_at.desc(), PostLike.id.desc())
+# what the purge compactor (app/users/purge.py) scans for
+Index("ix_posts_deleted_at", Post.deleted_at, postgresql_where=text("is_delete IS true"))
+Index("ix_comments_deleted_at", Comment.deleted_at, postgresql_where=text("is_delete IS true"))
+Index("ix_userprofile_deleted_at", User.deleted_at, postgresql_where=text("is_delete IS true"))
+
+# search indexes (app/users/search.py). trigram GIN for fuzzy/substring user
+# lookups, an expression GIN for post full text search. the query has to use
+# POST_SEARCH_VECTOR exactly as written here for postgres to pick the index,
+# so it only contains literals and no bind parameters.
+event.listen(
+    SQLModel.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+POST_SEARCH_VECTOR = func.to_tsvector(
+    literal_column("'simple'::regconfig"),
+    func.coalesce(Post.title, literal_column("''"))
+    .op("||")(literal_column("' '"))
+    .op("||")(func.coalesce(Post.caption, literal_column("''"))),
+)
+Index("ix_userprofile_username_trgm", User.username, postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}, postgresql_where=LIVE_ROWS)
+Index("ix_userprofile_full_name_trgm", User.full_name, postgresql_using="gin", postgresql_ops={"full_name": "gin_trgm_ops"}, postgresql_where=LIVE_ROWS)
+Index("ix_posts_search_vector", POST_SEARCH_VECTOR, postgresql_using="gin", postgresql_where=LIVE_ROWS)
@@ -0,0 +1,196 @@
+'''
+hard deletes soft deleted rows once they are older than SOFT_DELETE_RETENTION_DAYS.
+
+every batch is its own short transaction: claim at most PURGE_BATCH_SIZE ids
+with FOR UPDATE SKIP LOCKED (rows a request or another purger holds are left
+for the next round), delete what references them, then the rows themselves,
+commit and pause for PURGE_BATCH_PAUSE seconds. a local lock_timeout makes a
+batch give up rather than queue behind a hot row, it is retried next round.
+
+comments go first, then posts together with their likes, comments, timeline
+entries and view sketches, then users that have no posts or comments left. a
+comment with replies and a user with content wait for a later round.
+
+the post counters were already corrected when the rows were soft deleted
+(app/users/crud.py), so nothing here touches likes_count or comments_count.
+the comments under a post were soft deleted together with it, other users'
+included, and are hard deleted with the post.
+'''
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, exists, func, or_, select, text, update
+from sqlalchemy.orm import aliased
+
+from app.core.database import async_session_maker
+from app.users.media import media_store
+from app.users.models import (
+    BlockedUser, Comment, Follow, MediaUpload, Post, PostLike, PostViewSketch, TimelineEntry, User,
+)
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_LOCK_TIMEOUT = text("SELECT set_config('lock_timeout', :value, true)")
+
+
+def _candidates(model, cutoff: datetime, limit: int, *conditions):
+    return (
+        select(model.id)
+        .where(model.is_delete.is_(True), model.deleted_at < cutoff, *conditions)
+        .order_by(model.deleted_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        # these are exactly the rows the soft delete criteria hide, also in the subqueries
+        .execution_options(include_deleted=True)
+    )
+
+
+class SoftDeletePurger:
+    def __init__(self, retention_days: int, batch_size: int, interval: float, batch_pause: float, lock_timeout_ms: int):
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.batch_pause = batch_pause
+        self.lock_timeout_ms = lock_timeout_ms
+        self._task: asyncio.Task | None = None
+        self.rounds = 0
+        self.failures = 0
+        # table -> rows hard deleted
+        self.purged: dict[str, int] = defaultdict(int)
+
+    async def _comments(self, session, cutoff: datetime) -> int:
+        reply = aliased(Comment)
+        ids = (await session.execute(_candidates(
+            Comment, cutoff, self.batch_size, ~exists().where(reply.reply_to_id == Comment.id)
+        ))).scalars().all()
+        if ids:
+            await session.execute(delete(Comment).where(Comment.id.in_(ids)))
+        return len(ids)
+
+    async def _posts(self, session, cutoff: datetime) -> int:
+        ids = (await session.execute(_candidates(Post, cutoff, self.batch_size))).scalars().all()
+        if ids:
+            for model in (PostLike, TimelineEntry, PostViewSketch, Comment):
+                await session.execute(delete(model).where(model.post_id.in_(ids)))
+            await session.execute(delete(Post).where(Post.id.in_(ids)))
+        return len(ids)
+
+    async def _users(self, session, cutoff: datetime) -> int:
+        ids = (await session.execute(_candidates(
+            User,
+            cutoff,
+            self.batch_size,
+            ~exists().where(Post.author_id == User.id),
+            ~exists().where(Comment.author_id == User.id),
+        ))).scalars().all()
+        if not ids:
+            return 0
+
+        # keep the counters of the users on the other side of each follow right
+        for own, other, field in (
+            (Follow.follower_id, Follow.followee_id, "followers_count"),
+            (Follow.followee_id, Follow.follower_id, "following_count"),
+        ):
+            lost = (
+                select(other.label("user_id"), func.count().label("n"))
+                .where(own.in_(ids))
+                .group_by(other)
+                .subquery()
+            )
+            await session.execute(
+                update(User)
+                .where(User.id == lost.c.user_id)
+                .values({field: getattr(User, field) - lost.c.n})
+                .execution_options(synchronize_session=False)
+            )
+        await session.execute(delete(Follow).where(or_(Follow.follower_id.in_(ids), Follow.followee_id.in_(ids))))
+        await session.execute(delete(BlockedUser).where(or_(BlockedUser.blocker_id.in_(ids), BlockedUser.blocked_id.in_(ids))))
+        await session.execute(delete(TimelineEntry).where(or_(TimelineEntry.user_id.in_(ids), TimelineEntry.author_id.in_(ids))))
+        await session.execute(delete(PostLike).where(PostLike.user_id.in_(ids)))
+        storage_keys = (await session.execute(
+            delete(MediaUpload).where(MediaUpload.owner_id.in_(ids)).returning(MediaUpload.storage_key)
+        )).scalars().all()
+        await session.execute(delete(User).where(User.id.in_(ids)))
+        await session.commit()
+
+        # only once the rows are really gone
+        for key in storage_keys:
+            await asyncio.to_thread(media_store.remove, key)
+        return len(ids)
+
+    async def _batch(self, table: str, purge, cutoff: datetime) -> int:
+        async with async_session_maker() as session:
+            if session.get_bind().dialect.name == "postgresql":
+                await session.execute(_LOCK_TIMEOUT, {"value": f"{self.lock_timeout_ms}ms"})
+            purged = await purge(session, cutoff)
+            await session.commit()
+        self.purged[table] += purged
+        return purged
+
+    async def purge_once(self) -> int:
+        '''
+        one round over all tables, batch after batch until nothing is due. returns rows purged
+        '''
+        cutoff = datetime.now() - timedelta(days=self.retention_days)
+        total = 0
+        for table, purge in (("comments", self._comments), ("posts", self._posts), ("userprofile", self._users)):
+            while True:
+                try:
+                    purged = await self._batch(table, purge, cutoff)
+                except Exception:
+                    # most likely the lock timeout, the rows are still there next round
+                    self.failures += 1
+                    logger.warning("purge batch failed", extra={"table": table}, exc_info=True)
+                    break
+                total += purged
+                if purged < self.batch_size:
+                    break
+                await asyncio.sleep(self.batch_pause)
+        self.rounds += 1
+        if total:
+            logger.info("purged soft deleted rows", extra={"rows": total})
+        return total
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.purge_once()
+            except Exception:
+                logger.exception("purge round failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        '''
+        a batch cut off here rolls back as a whole
+        '''
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "rounds": self.rounds,
+            "failures": self.failures,
+            "purged": dict(self.purged),
+        }
+
+
+soft_delete_purger = SoftDeletePurger(
+    retention_days=settings.SOFT_DELETE_RETENTION_DAYS,
+    batch_size=settings.PURGE_BATCH_SIZE,
+    interval=settings.PURGE_INTERVAL_SECONDS,
+    batch_pause=settings.PURGE_BATCH_PAUSE,
+    lock_timeout_ms=settings.PURGE_LOCK_TIMEOUT_MS,
+)
@@ -0,0 +1,164 @@
+'''
+shared read side of the post, comment and like handlers.
+
+statements are built once per filter shape (which columns are filtered, which
+columns are selected, cursor or not, limit or not) with bind parameters in place
+of the values and kept on the handler class, later calls only bind new values.
+passing `schema=` selects just the columns that schema needs and returns plain
+Row tuples instead of session-tracked ORM objects.
+'''
+from typing import Generic, TypeVar
+
+from pydantic import BaseModel
+from sqlalchemy import Integer, and_, bindparam, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import SQLModel
+
+from app.core.database import read_only
+from app.users.counters import COUNTER_FIELDS, counter_buffer
+from app.users.counts import CountResult, CountService
+from app.users.helpers import decode_cursor, split_page
+
+ModelT = TypeVar("ModelT", bound=SQLModel)
+
+
+class BaseRepository(Generic[ModelT]):
+    model: type[ModelT]
+    # schema field -> (column expression, (joined model, onclause) | None) for
+    # fields that are not a column of `model` under the same name
+    column_aliases: dict = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._statements = {}
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    def projection(self, schema: type[BaseModel]) -> tuple[list, list]:
+        columns, joins = [], []
+        table_columns = self.model.__table__.c
+        fields = list(schema.model_fields)
+        # keyset pagination needs these on every row
+        for required in ("created_at", "id"):
+            if required not in fields:
+                fields.append(required)
+        for name in fields:
+            if name in self.column_aliases:
+                expression, join = self.column_aliases[name]
+                columns.append(expression.label(name))
+                if join is not None and join not in joins:
+                    joins.append(join)
+            elif name in table_columns:
+                columns.append(getattr(self.model, name))
+        return columns, joins
+
+    def _statement(self, filter_keys: tuple[str, ...], schema: type[BaseModel] | None, seek: bool, limited: bool):
+        key = (filter_keys, schema, seek, limited)
+        statement = self._statements.get(key)
+        if statement is not None:
+            return statement
+
+        if schema is None:
+            statement = select(self.model)
+        else:
+            columns, joins = self.projection(schema)
+            statement = select(*columns).select_from(self.model)
+            for target, onclause in joins:
+                statement = statement.join(target, onclause)
+
+        conditions = [getattr(self.model, name) == bindparam(f"f_{name}") for name in filter_keys]
+        if conditions:
+            statement = statement.where(and_(*conditions))
+        if seek:
+            statement = statement.where(
+                tuple_(self.model.created_at, self.model.id)
+                < tuple_(
+                    bindparam("cursor_created_at", type_=self.model.created_at.type),
+                    bindparam("cursor_id", type_=self.model.id.type),
+                )
+            )
+        statement = statement.order_by(self.model.created_at.desc(), self.model.id.desc())
+        if limited:
+            statement = statement.limit(bindparam("limit", type_=Integer))
+
+        self._statements[key] = statement
+        return statement
+
+    def _merge_counters(self, rows: list) -> list:
+        '''
+        fold not yet flushed counter deltas into the page, ORM rows are patched
+        in place, projected rows with a pending delta are swapped for a dict
+        '''
+        if self.model not in COUNTER_FIELDS:
+            return rows
+        if rows and isinstance(rows[0], self.model):
+            return counter_buffer.merge_into(rows)
+        labels = {
+            expression.key: name
+            for name, (expression, _) in self.column_aliases.items()
+            if getattr(expression, "class_", None) is self.model
+        }
+        merged = []
+        for row in rows:
+            pending = {field: delta for field, delta in counter_buffer.pending(self.model, row.id).items() if delta}
+            if pending:
+                row = dict(row._mapping)
+                for field, delta in pending.items():
+                    label = labels.get(field, field)
+                    if label in row:
+                        row[label] += delta
+            merged.append(row)
+        return merged
+
+    @read_only
+    async def filter_by(self, filters: dict, cursor: str | None = None, limit: int | None = None, schema: type[BaseModel] | None = None) -> list:
+        page, _ = await self.paginate(filters, cursor=cursor, limit=limit, schema=schema)
+        return page
+
+    def _bind(self, filters: dict, cursor: str | None) -> tuple[tuple[str, ...], dict]:
+        table_columns = self.model.__table__.c
+        filters = {name: value for name, value in filters.items() if name in table_columns}
+        params = {f"f_{name}": value for name, value in filters.items()}
+        if cursor:
+            params["cursor_created_at"], params["cursor_id"] = decode_cursor(cursor)
+        return tuple(sorted(filters)), params
+
+    @read_only
+    async def paginate(self, filters: dict, cursor: str | None = None, limit: int | None = None, schema: type[BaseModel] | None = None) -> tuple[list, str | None]:
+        filter_keys, params = self._bind(filters, cursor)
+        if limit:
+            # one look-ahead row tells split_page whether there is a next page
+            params["limit"] = limit + 1
+
+        statement = self._statement(filter_keys, schema, bool(cursor), bool(limit))
+        result = await self.session.execute(statement, params)
+        rows = result.scalars().all() if schema is None else result.all()
+        return split_page(self._merge_counters(rows), limit)
+
+    @read_only
+    async def stream(self, filters: dict, cursor: str | None = None, schema: type[BaseModel] | None = None, batch_size: int = 1000):
+        '''
+        every matching row newest first, fetched `batch_size` at a time through a
+        server-side cursor, yields one list of rows per batch
+        '''
+        filter_keys, params = self._bind(filters, cursor)
+        statement = self._statement(filter_keys, schema, bool(cursor), False).execution_options(yield_per=batch_size)
+        if schema is None:
+            result = await self.session.stream_scalars(statement, params)
+        else:
+            result = await self.session.stream(statement, params)
+        async for partition in result.partitions():
+            yield self._merge_counters(partition)
+
+    @read_only
+    async def get_all(self) -> list[ModelT]:
+        result = await self.session.execute(select(self.model))
+        return result.scalars().all()
+
+    @read_only
+    async def count(self, filters: dict | None = None, mode: str = "exact") -> CountResult:
+        '''
+        mode -> exact | cached | estimated, see app/users/counts.py
+        '''
+        return await CountService(self.session).count(self.model, filters, mode=mode)
@@ -7,11 +7,24 @@ from app.users.models import User  # Your SQLModel user model
 from uuid import UUID
 from deps import get_session
 from .crud import UserServiceHandler, PostServiceHandler, CommentServiceHandler, PostLikeHandler
+from .timeline import TimelineHandler, FollowHandler
+from .threads import CommentThreadHandler
+from .blocks import BlockHandler
+from .search import SearchHandler, username_index
+from .views import PostViewHandler, view_ingestor
+from .media import MediaHandler, media_store, media_url
+from app.core.storage import UploadConflict, UploadTooLarge
+from .export import export_rows, EXPORT_FORMATS
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from app.users.schemas import *
 from fastapi_utils.cbv import cbv
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.auth.auth_bearer import JWTBearer
 from pydantic import ValidationError
+from config import settings
+from app.core.responses import page_response
+from app.users.helpers import decode_cursor
 
 router = APIRouter()
 
@@ -42,8 +55,7 @@ class UserAPIWrapper:
                 status="Error",
                 status_code=403
             )
-        user_data = jwt_handler.verify_jwt(credentials.credentials,session)
-        print(f"\n\nuser_data:\n{user_data}\n\n")
+        user_data = await jwt_handler.verify_jwt(credentials.credentials,session)
         user = await handler.get_user_by_id(user_id=user_data.get("user_id"))
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -58,25 +70,246 @@ class UserAPIWrapper:
                 status="Error",
                 status_code=403
             )
-        user = jwt_handler.verify_jwt(credentials.credentials,session)
+        user = await jwt_handler.verify_jwt(credentials.credentials,session)
         updated_user = await handler.update_user(user_id=user.get("user_id"), update_data=update_data)
         if not updated_user:
             raise HTTPException(status_code=404, detail="User not found")
         return updated_user
     
+    @router.post("/follow/{user_id}", response_model=ResponseSchema)
+    async def follow_user(user_id: UUID, credentials: HTTPAuthorizationCredentials = Depends(security), session: Session = Depends(get_session)):
+        user = await jwt_handler.verify_jwt(credentials.credentials,session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        try:
+            followed = await FollowHandler(session).follow(follower_id=user.get("user_id"), followee_id=user_id)
+        except LookupError:
+            return ResponseSchema(
+                message="user not found",
+                status="Error",
+                status_code=404
+            )
+        except ValueError as e:
+            return ResponseSchema(
+                message=f"{e}",
+                status="Error",
+                status_code=400
+            )
+        return ResponseSchema(
+            message="user followed successfully" if followed else "already following user",
+            status="success",
+            status_code=200
+        )
+
+    @router.delete("/follow/{user_id}", response_model=ResponseSchema)
+    async def unfollow_user(user_id: UUID, credentials: HTTPAuthorizationCredentials = Depends(security), session: Session = Depends(get_session)):
+        user = await jwt_handler.verify_jwt(credentials.credentials,session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        unfollowed = await FollowHandler(session).unfollow(follower_id=user.get("user_id"), followee_id=user_id)
+        if not unfollowed:
+            return ResponseSchema(
+                message="not following user",
+                status="Error",
+                status_code=400
+            )
+        return ResponseSchema(
+            message="user unfollowed successfully",
+            status="success",
+            status_code=200
+        )
+
+    @router.post("/block/{user_id}", response_model=ResponseSchema)
+    async def block_user(user_id: UUID, credentials: HTTPAuthorizationCredentials = Depends(security), session: Session = Depends(get_session)):
+        user = await jwt_handler.verify_jwt(credentials.credentials,session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        try:
+            blocked = await BlockHandler(session).block(blocker_id=user.get("user_id"), blocked_id=user_id)
+        except LookupError:
+            return ResponseSchema(
+                message="user not found",
+                status="Error",
+                status_code=404
+            )
+        except ValueError as e:
+            return ResponseSchema(
+                message=f"{e}",
+                status="Error",
+                status_code=400
+            )
+        return ResponseSchema(
+            message="user blocked successfully" if blocked else "user already blocked",
+            status="success",
+            status_code=200
+        )
+
+    @router.delete("/block/{user_id}", response_model=ResponseSchema)
+    async def unblock_user(user_id: UUID, credentials: HTTPAuthorizationCredentials = Depends(security), session: Session = Depends(get_session)):
+        user = await jwt_handler.verify_jwt(credentials.credentials,session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        unblocked = await BlockHandler(session).unblock(blocker_id=user.get("user_id"), blocked_id=user_id)
+        return ResponseSchema(
+            message="user unblocked successfully" if unblocked else "user was not blocked",
+            status="success",
+            status_code=200
+        )
+
+    @router.post("/can_see/", response_model=ResponseSchema)
+    async def can_see(payload: dict, credentials: HTTPAuthorizationCredentials = Depends(security), session: Session = Depends(get_session)):
+        '''
+        payload -> {"user_ids": [...]}, returns whether the logged in user can see each of them
+        '''
+        user = await jwt_handler.verify_jwt(credentials.credentials,session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        try:
+            visible = await BlockHandler(session).can_see(user.get("user_id"), payload.get("user_ids") or [])
+        except ValueError:
+            return ResponseSchema(
+                message="Invalid Request Payload",
+                status="Error",
+                status_code=400
+            )
+        return ResponseSchema(
+            message="visibility fetched successfully",
+            status="success",
+            status_code=200,
+            data_dict={str(user_id): allowed for user_id, allowed in visible.items()}
+        )
+
     # for searching user use
+    @router.get("/search/users/", response_model=ResponseSchema)
+    async def search_users(q: str, cursor: str | None = None, page_size: int = 20, credentials: HTTPAuthorizationCredentials = Depends(security), session: Session = Depends(get_session)):
+        user = await jwt_handler.verify_jwt(credentials.credentials,session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        if len(q.strip()) < 2:
+            return ResponseSchema(
+                message="search query needs at least 2 characters",
+                status="Error",
+                status_code=400
+            )
+        try:
+            rows, next_cursor = await SearchHandler(session).search_users(q.strip(), cursor=cursor, limit=min(page_size, 50), viewer_id=user.get("user_id"))
+        except ValueError:
+            return ResponseSchema(
+                message="Invalid cursor",
+                status="Error",
+                status_code=400
+            )
+        return ResponseSchema(
+            message="users fetched successfully",
+            status="success",
+            status_code=200,
+            data_list=[
+                {
+                    "id": str(row.id),
+                    "username": row.username,
+                    "full_name": row.full_name,
+                    "bio": row.bio,
+                    "followers_count": row.followers_count,
+                    "rank": row.rank,
+                }
+                for row in rows
+            ],
+            pagination_data={
+                "cursor":cursor,
+                "next_cursor":next_cursor,
+                "has_more":next_cursor is not None,
+                "page_size":page_size,
+            }
+        )
+
+    @router.get("/search/posts/", response_model=ResponseSchema)
+    async def search_posts(q: str, cursor: str | None = None, page_size: int = 20, credentials: HTTPAuthorizationCredentials = Depends(security), session: Session = Depends(get_session)):
+        user = await jwt_handler.verify_jwt(credentials.credentials,session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        if not q.strip():
+            return ResponseSchema(
+                message="search query is required",
+                status="Error",
+                status_code=400
+            )
+        try:
+            rows, next_cursor = await SearchHandler(session).search_posts(q.strip(), PostFetchSchema, cursor=cursor, limit=min(page_size, 50), viewer_id=user.get("user_id"))
+        except ValueError:
+            return ResponseSchema(
+                message="Invalid cursor",
+                status="Error",
+                status_code=400
+            )
+        return page_response(
+            PostFetchSchema,
+            rows,
+            message="posts fetched successfully",
+            pagination_data={
+                "cursor":cursor,
+                "next_cursor":next_cursor,
+                "has_more":next_cursor is not None,
+                "page_size":page_size,
+            }
+        )
+
+    @router.get("/autocomplete/", response_model=ResponseSchema)
+    async def autocomplete(prefix: str, limit: int = 10, credentials: HTTPAuthorizationCredentials = Depends(security), session: Session = Depends(get_session)):
+        user = await jwt_handler.verify_jwt(credentials.credentials,session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        if not prefix:
+            return ResponseSchema(
+                message="prefix is required",
+                status="Error",
+                status_code=400
+            )
+        matches = await username_index.complete(prefix, min(limit, 20), session)
+        return ResponseSchema(
+            message="usernames fetched successfully",
+            status="success",
+            status_code=200,
+            data_list=[{"id": str(user_id), "username": username} for username, user_id in matches]
+        )
 
 @cbv(router)
 class PostAPIWrapper:
     session: Session = Depends(get_session)
         
+    # 👇 cbv injects the dependencies before calling __init__
     def __init__(self):
-        self.post_handler = None
-        self.comment_handler = None
-        self.like_handler = None
-
-    # 👇 run after dependencies injected
-    def __post_init__(self):
         self.post_handler = PostServiceHandler(self.session)
         self.comment_handler = CommentServiceHandler(self.session)
         self.like_handler = PostLikeHandler(self.session)
@@ -92,7 +325,7 @@ class PostAPIWrapper:
                     status="Error",
                     status_code=403
                 )
-            user = jwt_handler.verify_jwt(credentials.credentials)
+            user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
             if not user:
                 return ResponseSchema(
                     message="Access Denied",
@@ -102,11 +335,22 @@ class PostAPIWrapper:
             post_data.update({
                 "author_id":user.get("user_id")
             })
+            media_upload_id = post_data.pop("media_upload_id", None)
+            if media_upload_id:
+                try:
+                    post_data["media_url"] = await MediaHandler(self.session).media_url_for(UUID(str(media_upload_id)), user.get("user_id"))
+                except ValueError as e:
+                    return ResponseSchema(
+                        message=f"{e}",
+                        status="Error",
+                        status_code=400
+                    )
                 
             #validate input payload
             post_data = PostCreateSchema(**post_data)
-            post = self.post_handler.create(post_data=post_data)
-            post_data = PostFetchSchema.model_validate(post)
+            post = await self.post_handler.create(post_data=post_data)
+            # PostFetchSchema also needs the author's username, which the new row doesn't carry
+            post_data = PostFetchSchema.model_validate(await self.post_handler.get_post(post.id), from_attributes=True)
             
             return ResponseSchema(
                 message="post created successfully",
@@ -127,16 +371,277 @@ class PostAPIWrapper:
                 status_code=500
             )
     
+    @router.post('/like/{post_id}', response_model=ResponseSchema)
+    async def like_post(self, post_id : UUID, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        try:
+            user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+            if not user:
+                return ResponseSchema(
+                    message="Access Denied",
+                    status="Error",
+                    status_code=403
+                )
+            pl = await self.like_handler.create(PostLikeSchema(user_id=user.get("user_id"), post_id=post_id))
+            return ResponseSchema(
+                message="post liked successfully",
+                status="success",
+                status_code=200,
+                data_dict=PostLikeFetchSchema(id=pl.id, user_id=pl.user_id, post_id=pl.post_id).model_dump()
+            )
+        except LookupError:
+            return ResponseSchema(
+                message="post not found",
+                status="Error",
+                status_code=404
+            )
+        except Exception as e:
+            return ResponseSchema(
+                message=f"Error - {e}",
+                status="Error",
+                status_code=500
+            )
+
+    @router.delete('/like/{post_id}', response_model=ResponseSchema)
+    async def unlike_post(self, post_id : UUID, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        try:
+            user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+            if not user:
+                return ResponseSchema(
+                    message="Access Denied",
+                    status="Error",
+                    status_code=403
+                )
+            removed = await self.like_handler.remove(user_id=user.get("user_id"), post_id=post_id)
+            return ResponseSchema(
+                message="post unliked successfully" if removed else "post was not liked",
+                status="success",
+                status_code=200
+            )
+        except Exception as e:
+            return ResponseSchema(
+                message=f"Error - {e}",
+                status="Error",
+                status_code=500
+            )
+
+    @router.post('/views/', response_model=ResponseSchema)
+    async def record_views(self, view_data : dict, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        '''
+        payload -> {"post_ids": [...]}, one entry per view, repeats count as more views
+        '''
+        user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        post_ids = view_data.get("post_ids") or []
+        if not post_ids or len(post_ids) > settings.VIEW_BATCH_MAX:
+            return ResponseSchema(
+                message=f"post_ids must have between 1 and {settings.VIEW_BATCH_MAX} items",
+                status="Error",
+                status_code=400
+            )
+        try:
+            accepted = view_ingestor.submit(user.get("user_id"), post_ids)
+        except ValueError:
+            return ResponseSchema(
+                message=f"Invalid Request Payload",
+                status="Error",
+                status_code=400
+            )
+        return ResponseSchema(
+            message="views recorded",
+            status="success",
+            status_code=202,
+            data_dict={"accepted": accepted}
+        )
+
+    @router.get('/views/{post_id}', response_model=ResponseSchema)
+    async def view_counts(self, post_id : UUID, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        try:
+            user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+            if not user:
+                return ResponseSchema(
+                    message="Access Denied",
+                    status="Error",
+                    status_code=403
+                )
+            counts = await PostViewHandler(self.session).view_counts(post_id)
+            if counts is None:
+                return ResponseSchema(
+                    message="post not found",
+                    status="Error",
+                    status_code=404
+                )
+            return ResponseSchema(
+                message="views fetched successfully",
+                status="success",
+                status_code=200,
+                data_dict=counts
+            )
+        except Exception as e:
+            return ResponseSchema(
+                message=f"Error - {e}",
+                status="Error",
+                status_code=500
+            )
+
+    @router.post('/has_liked/', response_model=ResponseSchema)
+    async def has_liked(self, like_data : dict, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        '''
+        payload -> {"post_ids": [...]}, returns which of them the user has liked
+        '''
+        try:
+            user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+            if not user:
+                return ResponseSchema(
+                    message="Access Denied",
+                    status="Error",
+                    status_code=403
+                )
+            post_ids = like_data.get("post_ids") or []
+            if len(post_ids) > settings.BULK_MAX_ITEMS:
+                return ResponseSchema(
+                    message=f"post_ids can have at most {settings.BULK_MAX_ITEMS} items",
+                    status="Error",
+                    status_code=400
+                )
+            liked = await self.like_handler.liked_post_ids(user.get("user_id"), post_ids)
+            return ResponseSchema(
+                message="likes fetched successfully",
+                status="success",
+                status_code=200,
+                data_dict={str(post_id): UUID(str(post_id)) in liked for post_id in post_ids}
+            )
+        except ValueError:
+            return ResponseSchema(
+                message=f"Invalid Request Payload",
+                status="Error",
+                status_code=400
+            )
+        except Exception as e:
+            return ResponseSchema(
+                message=f"Error - {e}",
+                status="Error",
+                status_code=500
+            )
+
+    @router.post('/bulk_like/', response_model=ResponseSchema)
+    async def bulk_like(self, like_data : dict, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        '''
+        payload -> {"post_ids": [...]}
+        '''
+        try:
+            user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+            if not user:
+                return ResponseSchema(
+                    message="Access Denied",
+                    status="Error",
+                    status_code=403
+                )
+            post_ids = like_data.get("post_ids") or []
+            if not post_ids or len(post_ids) > settings.BULK_MAX_ITEMS:
+                return ResponseSchema(
+                    message=f"post_ids must have between 1 and {settings.BULK_MAX_ITEMS} items",
+                    status="Error",
+                    status_code=400
+                )
+            likes_data = [PostLikeSchema(user_id=user.get("user_id"), post_id=post_id) for post_id in post_ids]
+            likes = await self.like_handler.create_many(likes_data)
+            return ResponseSchema(
+                message="posts liked successfully",
+                status="success",
+                status_code=200,
+                data_list=[PostLikeFetchSchema(id=pl.id, user_id=pl.user_id, post_id=pl.post_id).model_dump() for pl in likes]
+            )
+        except LookupError as e:
+            return ResponseSchema(
+                message=f"{e}",
+                status="Error",
+                status_code=404
+            )
+        except ValidationError:
+            return ResponseSchema(
+                message=f"Invalid Request Payload",
+                status="Error",
+                status_code=400
+            )
+        except Exception as e:
+            return ResponseSchema(
+                message=f"Error - {e}",
+                status="Error",
+                status_code=500
+            )
+
+    @router.post('/bulk_comment/', response_model=ResponseSchema)
+    async def bulk_comment(self, comment_data : dict, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        '''
+        payload -> {"comments": [{"post_id": ..., "content": ..., "is_reply": ..., "reply_to_id": ...}]}
+        '''
+        try:
+            user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+            if not user:
+                return ResponseSchema(
+                    message="Access Denied",
+                    status="Error",
+                    status_code=403
+                )
+            comments = comment_data.get("comments") or []
+            if not comments or len(comments) > settings.BULK_MAX_ITEMS:
+                return ResponseSchema(
+                    message=f"comments must have between 1 and {settings.BULK_MAX_ITEMS} items",
+                    status="Error",
+                    status_code=400
+                )
+            comments_data = [
+                CommentCreateSchema(**{**comment, "author_id": user.get("user_id")})
+                for comment in comments
+            ]
+            created = await self.comment_handler.create_many(comments_data)
+            return ResponseSchema(
+                message="comments created successfully",
+                status="success",
+                status_code=200,
+                data_list=[CommentFetchSchema.model_validate(comment, from_attributes=True).model_dump() for comment in created]
+            )
+        except LookupError as e:
+            return ResponseSchema(
+                message=f"{e}",
+                status="Error",
+                status_code=404
+            )
+        except ValidationError:
+            return ResponseSchema(
+                message=f"Invalid Request Payload",
+                status="Error",
+                status_code=400
+            )
+        except ValueError as e:
+            return ResponseSchema(
+                message=f"{e}",
+                status="Error",
+                status_code=400
+            )
+        except Exception as e:
+            return ResponseSchema(
+                message=f"Error - {e}",
+                status="Error",
+                status_code=500
+            )
+
     @router.get('/fetch_all_post_for_user/', response_model=ResponseSchema)
-    async def get_all_post_for_user(self,req_type : str, page : int | None =None, page_size : int | None = None, post_id : UUID | None = None, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    async def get_all_post_for_user(self,req_type : str, cursor : str | None = None, page_size : int | None = None, post_id : UUID | None = None, count_mode : str | None = None, credentials: HTTPAuthorizationCredentials = Depends(security)):
         '''
         request type:
-        all_post -> want to fetch all post
+        all_post -> want to fetch all post, pass back pagination_data.next_cursor to get the next page
         specific_post -> want to fetch specific post
+        count_mode -> exact | cached | estimated, adds the total to pagination_data
         '''
         try:
             # fetch user
-            user = jwt_handler.verify_jwt(credentials.credentials)
+            user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
             
             if not user:
                 return ResponseSchema(
@@ -145,32 +650,53 @@ class PostAPIWrapper:
                     status_code=403
                 )
             if req_type =="all_post":
-                if not page or not page_size:
+                if not page_size:
                     return ResponseSchema(
-                        message="Page number and page size is required",
+                        message="Page size is required",
                         status="Error",
                         status_code=400,
                     )
-                ofset = page*page_size
-                limit = ofset+page_size
-                posts = self.post_handler.filter_by(
-                    {
-                        "author_id": user.get("user_id")
-                    },
-                    ofset=ofset,
-                    limit=limit
-                )
-                resp = [PostFetchSchema.model_validate(post) for post in posts]
-                return ResponseSchema(
+                try:
+                    posts, next_cursor = await self.post_handler.paginate(
+                        {
+                            "author_id": user.get("user_id")
+                        },
+                        cursor=cursor,
+                        limit=page_size,
+                        schema=PostFetchSchema
+                    )
+                except ValueError:
+                    return ResponseSchema(
+                        message="Invalid cursor",
+                        status="Error",
+                        status_code=400,
+                    )
+                pagination_data={
+                    "cursor":cursor,
+                    "next_cursor":next_cursor,
+                    "has_more":next_cursor is not None,
+                    "page_size":page_size,
+                }
+                if count_mode:
+                    try:
+                        total = await self.post_handler.count({"author_id": user.get("user_id")}, mode=count_mode)
+                    except ValueError as e:
+                        return ResponseSchema(
+                            message=f"{e}",
+                            status="Error",
+                            status_code=400,
+                        )
+                    pagination_data.update({
+                        "total":total.value,
+                        "total_is_approximate":total.approximate,
+                        "count_mode":total.mode,
+                    })
+                # rows are validated once and written straight to JSON bytes
+                return page_response(
+                    PostFetchSchema,
+                    posts,
                     message="post fetched succesfully",
-                    status="success",
-                    status_code=200,
-                    data_list=resp,
-                    pagination_data={
-                        "page":page,
-                        "next_page":page+1,
-                        "page_size":page_size,
-                    }
+                    pagination_data=pagination_data
                 )
             else:
                 if not post_id:
@@ -179,13 +705,15 @@ class PostAPIWrapper:
                         status = "Error",
                         status_code = 400
                     )
-                post= self.post_handler.filter_by(
-                    {
-                        "id": post_id,
-                        "author_id":user.get("user_id")
-                    }
-                )
-                post_data = PostFetchSchema.model_validate(post[0])
+                # hot posts are read by many at once, see post_cache in app/users/cache.py
+                post = await self.post_handler.get_post(post_id)
+                post_data = PostFetchSchema.model_validate(post, from_attributes=True) if post else None
+                if not post_data or str(post_data.author_id) != str(user.get("user_id")):
+                    return ResponseSchema(
+                        message = "post not found",
+                        status = "Error",
+                        status_code = 404
+                    )
                 return ResponseSchema(
                     message="post fetched successfully",
                     status="success",
@@ -207,27 +735,172 @@ class PostAPIWrapper:
                 status_code=500
             )
     
-    @router.delete('\delete_post\{post_id}')
-    async def delete_post(self,post_id:str, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    @router.get('/feed/', response_model=ResponseSchema)
+    async def get_feed(self, cursor : str | None = None, page_size : int = 20, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        '''
+        home timeline of the logged in user, newest first
+        '''
         try:
-            # fetch user
-            user = jwt_handler.verify_jwt(credentials.credentials)
-
+            user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
             if not user:
                 return ResponseSchema(
                     message="Access Denied",
                     status="Error",
                     status_code=403
                 )
+            try:
+                rows, next_cursor = await TimelineHandler(self.session).feed(
+                    user_id=user.get("user_id"),
+                    cursor=cursor,
+                    limit=page_size
+                )
+            except ValueError:
+                return ResponseSchema(
+                    message="Invalid cursor",
+                    status="Error",
+                    status_code=400,
+                )
+            liked = await self.like_handler.liked_post_ids(user.get("user_id"), [post.id for post, _ in rows])
+            resp = [
+                {
+                    **post.model_dump(),
+                    "author_username": username,
+                    "comment_count": post.comments_count,
+                    "viewer_has_liked": post.id in liked
+                }
+                for post, username in rows
+            ]
+            return page_response(
+                PostFetchSchema,
+                resp,
+                message="feed fetched successfully",
+                pagination_data={
+                    "cursor":cursor,
+                    "next_cursor":next_cursor,
+                    "has_more":next_cursor is not None,
+                    "page_size":page_size,
+                }
+            )
+        except Exception as e:
+            return ResponseSchema(
+                message=f"Error - {e}",
+                status="Error",
+                status_code=500
+            )
 
-            post = self.post_handler.update(
-                post_id=post_id,
-                update_data={
-                    "is_delete":True,
-                    "deleted_at":datetime.now()
+    @router.get('/comment_thread/', response_model=ResponseSchema)
+    async def get_comment_thread(self, post_id : UUID, parent_id : UUID | None = None, cursor : str | None = None, page_size : int = 20, replies_per_level : int = 3, depth : int = 2, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        '''
+        comments of a post with up to `replies_per_level` replies per comment, `depth` levels deep.
+        to expand a branch pass parent_id (and the comment's replies_cursor as cursor)
+        '''
+        try:
+            user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+            if not user:
+                return ResponseSchema(
+                    message="Access Denied",
+                    status="Error",
+                    status_code=403
+                )
+            if min(page_size, replies_per_level, depth) < 1:
+                return ResponseSchema(
+                    message="page_size, replies_per_level and depth must be at least 1",
+                    status="Error",
+                    status_code=400,
+                )
+            try:
+                comments, next_cursor = await CommentThreadHandler(self.session).load_thread(
+                    post_id=post_id,
+                    viewer_id=user.get("user_id"),
+                    parent_id=parent_id,
+                    cursor=cursor,
+                    limit=min(page_size, 100),
+                    replies_per_level=min(replies_per_level, 50),
+                    max_depth=min(depth, 10)
+                )
+            except ValueError:
+                return ResponseSchema(
+                    message="Invalid cursor",
+                    status="Error",
+                    status_code=400,
+                )
+            return ResponseSchema(
+                message="comments fetched successfully",
+                status="success",
+                status_code=200,
+                data_list=comments,
+                pagination_data={
+                    "cursor":cursor,
+                    "next_cursor":next_cursor,
+                    "has_more":next_cursor is not None,
+                    "page_size":page_size,
                 }
             )
-            if not post:
+        except Exception as e:
+            return ResponseSchema(
+                message=f"Error - {e}",
+                status="Error",
+                status_code=500
+            )
+
+    @router.get('/export/{kind}')
+    async def export(self, kind : str, format : str = "ndjson", cursor : str | None = None, post_id : UUID | None = None, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        '''
+        stream the user's own posts, comments or likes as ndjson or csv.
+        kind -> posts | comments | likes, post_id narrows comments/likes to one post,
+        cursor -> the `cursor` of the last row received to resume an export
+        '''
+        user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        exports = {
+            "posts": (PostServiceHandler, PostFetchSchema, {"author_id": user.get("user_id")}),
+            "comments": (CommentServiceHandler, CommentFetchSchema, {"author_id": user.get("user_id"), "post_id": post_id}),
+            "likes": (PostLikeHandler, PostLikeFetchSchema, {"user_id": user.get("user_id"), "post_id": post_id}),
+        }
+        if kind not in exports or format not in EXPORT_FORMATS:
+            return ResponseSchema(
+                message=f"kind must be one of {list(exports)} and format one of {list(EXPORT_FORMATS)}",
+                status="Error",
+                status_code=400
+            )
+        handler_class, schema, filters = exports[kind]
+        filters = {key: value for key, value in filters.items() if value is not None}
+        try:
+            if cursor:
+                decode_cursor(cursor)
+        except ValueError:
+            return ResponseSchema(
+                message="Invalid cursor",
+                status="Error",
+                status_code=400,
+            )
+        return StreamingResponse(
+            export_rows(handler_class, schema, filters, cursor=cursor, fmt=format, batch_size=settings.EXPORT_BATCH_SIZE),
+            media_type=EXPORT_FORMATS[format],
+            headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'}
+        )
+
+    @router.delete('/delete_post/{post_id}', response_model=ResponseSchema)
+    async def delete_post(self, post_id : UUID, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        try:
+            # fetch user
+            user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+
+            if not user:
+                return ResponseSchema(
+                    message="Access Denied",
+                    status="Error",
+                    status_code=403
+                )
+
+            # soft delete, the post drops out of every query right away and is purged later
+            deleted = await self.post_handler.soft_delete(post_id=post_id, author_id=user.get("user_id"))
+            if not deleted:
                 return ResponseSchema(
                     message="wrong post id",
                     status="Error",
@@ -258,4 +931,142 @@ class PostAPIWrapper:
         
     
 
-    
\ No newline at end of file
+    
+
+@cbv(router)
+class MediaAPIWrapper:
+    session: Session = Depends(get_session)
+
+    @router.post("/media/uploads/", response_model=ResponseSchema)
+    async def create_upload(self, upload_data: dict, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        '''
+        payload -> {"content_type": "video/mp4", "size": <total bytes>}
+        '''
+        user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        try:
+            upload = await MediaHandler(self.session).create_upload(
+                owner_id=user.get("user_id"),
+                content_type=upload_data.get("content_type"),
+                size=int(upload_data.get("size") or 0),
+            )
+        except (TypeError, ValueError) as e:
+            return ResponseSchema(
+                message=f"{e}",
+                status="Error",
+                status_code=400
+            )
+        return ResponseSchema(
+            message="upload created",
+            status="success",
+            status_code=201,
+            data_dict={"upload_id": str(upload.id), "offset": 0, "size": upload.size}
+        )
+
+    @router.get("/media/uploads/{upload_id}", response_model=ResponseSchema)
+    async def upload_status(self, upload_id: UUID, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        handler = MediaHandler(self.session)
+        upload = await handler.get_upload(upload_id, user.get("user_id"))
+        if not upload:
+            return ResponseSchema(
+                message="upload not found",
+                status="Error",
+                status_code=404
+            )
+        return ResponseSchema(
+            message="upload fetched successfully",
+            status="success",
+            status_code=200,
+            data_dict={
+                "upload_id": str(upload.id),
+                "offset": handler.offset(upload),
+                "size": upload.size,
+                "media_url": media_url(upload) if upload.completed_at else None,
+            }
+        )
+
+    @router.patch("/media/uploads/{upload_id}", response_model=ResponseSchema)
+    async def upload_chunk(self, upload_id: UUID, request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        '''
+        raw bytes in the body, Upload-Offset header -> offset the bytes start at
+        '''
+        user = await jwt_handler.verify_jwt(credentials.credentials, self.session)
+        if not user:
+            return ResponseSchema(
+                message="Access Denied",
+                status="Error",
+                status_code=403
+            )
+        handler = MediaHandler(self.session)
+        upload = await handler.get_upload(upload_id, user.get("user_id"))
+        if not upload:
+            return ResponseSchema(
+                message="upload not found",
+                status="Error",
+                status_code=404
+            )
+        try:
+            offset = int(request.headers["upload-offset"])
+        except (KeyError, ValueError):
+            return ResponseSchema(
+                message="Upload-Offset header is required",
+                status="Error",
+                status_code=400
+            )
+        try:
+            offset = await handler.write_chunk(upload, offset, request.stream())
+        except UploadConflict as e:
+            return ResponseSchema(
+                message=f"{e}",
+                status="Error",
+                status_code=409,
+                data_dict={"offset": handler.offset(upload)}
+            )
+        except UploadTooLarge as e:
+            return ResponseSchema(
+                message=f"{e}",
+                status="Error",
+                status_code=413,
+                data_dict={"offset": handler.offset(upload)}
+            )
+        return ResponseSchema(
+            message="chunk stored",
+            status="success",
+            status_code=200,
+            data_dict={
+                "upload_id": str(upload.id),
+                "offset": offset,
+                "size": upload.size,
+                "media_url": media_url(upload) if upload.completed_at else None,
+            }
+        )
+
+    @router.get("/media/{storage_key}")
+    async def download_media(self, storage_key: str):
+        '''
+        public so it works in <img>/<video> tags, keys are random 128 bit ids
+        '''
+        if not storage_key.isalnum():
+            raise HTTPException(status_code=404, detail="Media not found")
+        upload = await MediaHandler(self.session).get_by_key(storage_key)
+        if not upload:
+            raise HTTPException(status_code=404, detail="Media not found")
+        headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+        if settings.MEDIA_X_ACCEL_PREFIX:
+            # nginx serves the file itself (sendfile, ranges), the worker is free immediately
+            headers["X-Accel-Redirect"] = f"{settings.MEDIA_X_ACCEL_PREFIX}{media_store.relative_path(storage_key)}"
+            return Response(media_type=upload.content_type, headers=headers)
+        # handles Range requests, and uses the pathsend extension when the server offers it
+        return FileResponse(media_store.path(storage_key), media_type=upload.content_type, headers=headers)
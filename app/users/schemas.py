@@ -82,6 +82,7 @@ class PostFetchSchema(BaseModel):
     share_count: int
     created_at : datetime
     updated_at : datetime
+    viewer_has_liked : bool | None = None
     
 class CommentCreateSchema(BaseModel):
     content: str = Field(min_length=1, max_length=1000)
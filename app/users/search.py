@@ -0,0 +1,191 @@
+'''
+user and post search.
+
+users   -> trigram similarity on username/full_name (GIN gin_trgm_ops indexes)
+posts   -> full text match on title + caption (GIN index on POST_SEARCH_VECTOR)
+results are ranked and paged with a (rank, id) keyset cursor.
+
+autocomplete is served from UsernamePrefixIndex, a sorted in-process list of
+the most followed usernames searched with bisect, and only falls back to the
+database when the hot set does not fill the page.
+'''
+import asyncio
+import base64
+import bisect
+import json
+import time
+from uuid import UUID
+
+from pydantic import BaseModel
+from sqlalchemy import func, literal_column, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import async_session_maker, read_only
+from app.users.blocks import BlockHandler
+from app.users.crud import PostServiceHandler
+from app.users.models import POST_SEARCH_VECTOR, Post, User
+from config import settings
+
+
+def encode_rank_cursor(rank: float, row_id: UUID) -> str:
+    raw = json.dumps([rank, str(row_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_rank_cursor(cursor: str) -> tuple[float, UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(rank), UUID(row_id)
+    except Exception as e:
+        raise ValueError(f"InvalidCursor : {cursor}") from e
+
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _page(rows: list, limit: int) -> tuple[list, str | None]:
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_rank_cursor(rows[-1].rank, rows[-1].id)
+
+
+class SearchHandler:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    @read_only
+    async def search_users(self, query: str, cursor: str | None = None, limit: int = 20, viewer_id: UUID | None = None) -> tuple[list, str | None]:
+        rank = func.greatest(
+            func.similarity(User.username, query),
+            func.similarity(func.coalesce(User.full_name, ""), query),
+        ).label("rank")
+        pattern = f"%{_like_escape(query)}%"
+        statement = (
+            select(User.id, User.username, User.full_name, User.bio, User.followers_count, rank)
+            .where(
+                or_(User.username.ilike(pattern, escape="\\"), User.full_name.ilike(pattern, escape="\\")),
+                User.is_banned.is_(False),
+            )
+        )
+        if viewer_id:
+            hidden = await BlockHandler(self.session).hidden_user_ids(viewer_id)
+            if hidden:
+                statement = statement.where(User.id.not_in(hidden))
+        if cursor:
+            statement = statement.where(tuple_(rank, User.id) < tuple_(*decode_rank_cursor(cursor)))
+        statement = statement.order_by(rank.desc(), User.id.desc()).limit(limit + 1)
+        rows = (await self.session.execute(statement)).all()
+        return _page(rows, limit)
+
+    @read_only
+    async def search_posts(self, query: str, schema: type[BaseModel], cursor: str | None = None, limit: int = 20, viewer_id: UUID | None = None) -> tuple[list, str | None]:
+        '''
+        rows carry the columns `schema` needs, same projection as the post listings
+        '''
+        columns, joins = PostServiceHandler(self.session).projection(schema)
+        ts_query = func.websearch_to_tsquery(literal_column("'simple'::regconfig"), query)
+        rank = func.ts_rank(POST_SEARCH_VECTOR, ts_query).label("rank")
+        statement = select(*columns, rank).select_from(Post)
+        for target, onclause in joins:
+            statement = statement.join(target, onclause)
+        statement = statement.where(POST_SEARCH_VECTOR.op("@@")(ts_query))
+        if viewer_id:
+            hidden = await BlockHandler(self.session).hidden_user_ids(viewer_id)
+            if hidden:
+                statement = statement.where(Post.author_id.not_in(hidden))
+        if cursor:
+            statement = statement.where(tuple_(rank, Post.id) < tuple_(*decode_rank_cursor(cursor)))
+        statement = statement.order_by(rank.desc(), Post.id.desc()).limit(limit + 1)
+        rows = (await self.session.execute(statement)).all()
+        return _page(rows, limit)
+
+    @read_only
+    async def usernames_with_prefix(self, prefix: str, limit: int) -> list[tuple[str, UUID]]:
+        statement = (
+            select(User.username, User.id)
+            .where(User.username.ilike(f"{_like_escape(prefix)}%", escape="\\"), User.is_banned.is_(False))
+            .order_by(User.followers_count.desc())
+            .limit(limit)
+        )
+        return [tuple(row) for row in (await self.session.execute(statement)).all()]
+
+
+class UsernamePrefixIndex:
+    '''
+    sorted (lowercased username, username, id) of the AUTOCOMPLETE_HOT_USERS most
+    followed users, rebuilt in the background every AUTOCOMPLETE_REFRESH_SECONDS
+    '''
+
+    def __init__(self, size: int, refresh_seconds: int):
+        self.size = size
+        self.refresh_seconds = refresh_seconds
+        self._keys: list[str] = []
+        self._entries: list[tuple[str, str, UUID]] = []
+        self._loaded_at = 0.0
+        self._refreshing: asyncio.Task | None = None
+        self.hits = 0
+        self.fallbacks = 0
+
+    async def refresh(self) -> None:
+        async with async_session_maker() as session:
+            statement = (
+                select(User.username, User.id)
+                .where(User.is_banned.is_(False))
+                .order_by(User.followers_count.desc())
+                .limit(self.size)
+            )
+            rows = (await session.execute(statement)).all()
+        entries = sorted((username.lower(), username, user_id) for username, user_id in rows)
+        # swap both lists at once so readers never see a half built index
+        self._entries, self._keys = entries, [entry[0] for entry in entries]
+        self._loaded_at = time.monotonic()
+
+    def _schedule_refresh(self) -> None:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self.refresh())
+
+    def lookup(self, prefix: str, limit: int) -> list[tuple[str, UUID]]:
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self._keys, prefix)
+        matches = []
+        for key, username, user_id in self._entries[start:start + limit]:
+            if not key.startswith(prefix):
+                break
+            matches.append((username, user_id))
+        return matches
+
+    async def complete(self, prefix: str, limit: int, session: AsyncSession) -> list[tuple[str, UUID]]:
+        if not self._loaded_at:
+            # first use in this worker, everyone waits for the same load
+            self._schedule_refresh()
+            await asyncio.shield(self._refreshing)
+        elif time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self._schedule_refresh()
+
+        matches = self.lookup(prefix, limit)
+        if len(matches) >= limit:
+            self.hits += 1
+            return matches
+        self.fallbacks += 1
+        seen = {user_id for _, user_id in matches}
+        for username, user_id in await SearchHandler(session).usernames_with_prefix(prefix, limit):
+            if user_id not in seen and len(matches) < limit:
+                matches.append((username, user_id))
+        return matches
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+        }
+
+
+username_index = UsernamePrefixIndex(
+    size=settings.AUTOCOMPLETE_HOT_USERS,
+    refresh_seconds=settings.AUTOCOMPLETE_REFRESH_SECONDS,
+)
@@ -0,0 +1,135 @@
+'''
+comment threads loaded in a single recursive CTE.
+
+the first level is one keyset page of comments on a post (or of replies to
+`parent_id` when expanding a branch), every level below is capped at
+`replies_per_level` replies per comment through a LATERAL index probe on
+(reply_to_id, created_at, id). each comment that has more replies than were
+loaded carries a replies_cursor to fetch the rest of that level.
+
+this is plain SQL, so soft deleted comments are left out by hand on every
+level (the predicate matches the partial keyset indexes). a deleted comment
+hides its replies with it.
+'''
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import read_only
+from app.users.helpers import decode_cursor, encode_cursor
+from app.users.blocks import BlockHandler
+
+_COLUMNS = "id, content, is_reply, post_id, author_id, reply_to_id, created_at, updated_at"
+
+_THREAD_SQL = """
+WITH RECURSIVE thread AS (
+    SELECT {columns}, 0 AS depth, rn
+    FROM (
+        SELECT {columns}, row_number() OVER (ORDER BY created_at DESC, id DESC) AS rn
+        FROM comments
+        WHERE post_id = :post_id AND {first_level}
+        ORDER BY created_at DESC, id DESC
+        LIMIT :limit_plus_one
+    ) first_level
+    UNION ALL
+    SELECT {reply_columns}, t.depth + 1, r.rn
+    FROM thread t
+    CROSS JOIN LATERAL (
+        SELECT {columns}, row_number() OVER (ORDER BY created_at DESC, id DESC) AS rn
+        FROM comments c
+        WHERE c.reply_to_id = t.id AND c.is_delete IS NULL {hidden}
+        ORDER BY c.created_at DESC, c.id DESC
+        LIMIT :replies_plus_one
+    ) r
+    WHERE t.depth < :max_depth
+      AND t.rn <= CASE WHEN t.depth = 0 THEN :limit ELSE :replies_per_level END
+)
+SELECT t.*,
+       CASE WHEN t.depth = :max_depth
+            THEN EXISTS (SELECT 1 FROM comments c WHERE c.reply_to_id = t.id AND c.is_delete IS NULL)
+            ELSE false END AS replies_not_loaded
+FROM thread t
+ORDER BY t.depth, t.created_at DESC, t.id DESC
+"""
+
+
+class CommentThreadHandler:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    @read_only
+    async def load_thread(
+        self,
+        post_id: UUID,
+        viewer_id: UUID | None = None,
+        parent_id: UUID | None = None,
+        cursor: str | None = None,
+        limit: int = 20,
+        replies_per_level: int = 3,
+        max_depth: int = 2,
+    ) -> tuple[list[dict], str | None]:
+        '''
+        returns (comments, next_cursor) where each comment dict has its loaded
+        `replies` nested under it
+        '''
+        if min(limit, replies_per_level, max_depth) < 1:
+            raise ValueError("InvalidThread : limit, replies_per_level and max_depth must be at least 1")
+        params = {
+            "post_id": post_id,
+            "limit": limit,
+            "limit_plus_one": limit + 1,
+            "replies_per_level": replies_per_level,
+            "replies_plus_one": replies_per_level + 1,
+            "max_depth": max_depth,
+        }
+        first_level = ["reply_to_id IS NULL", "is_delete IS NULL"]
+        if parent_id:
+            first_level = ["reply_to_id = :parent_id", "is_delete IS NULL"]
+            params["parent_id"] = parent_id
+        if cursor:
+            params["cursor_created_at"], params["cursor_id"] = decode_cursor(cursor)
+            first_level.append("(created_at, id) < (:cursor_created_at, :cursor_id)")
+        hidden = ""
+        if viewer_id:
+            hidden_ids = await BlockHandler(self.session).hidden_user_ids(viewer_id)
+            if hidden_ids:
+                # comments of blocked users are dropped together with their replies
+                params["hidden_ids"] = list(hidden_ids)
+                hidden = "AND NOT (c.author_id = ANY(:hidden_ids))"
+                first_level.append("NOT (author_id = ANY(:hidden_ids))")
+
+        statement = text(_THREAD_SQL.format(
+            columns=_COLUMNS,
+            reply_columns=", ".join(f"r.{column.strip()}" for column in _COLUMNS.split(",")),
+            first_level=" AND ".join(first_level),
+            hidden=hidden,
+        ))
+        rows = (await self.session.execute(statement, params)).mappings().all()
+
+        nodes: dict[UUID, dict] = {}
+        top: list[dict] = []
+        next_cursor = None
+        for row in rows:
+            cap = limit if row["depth"] == 0 else replies_per_level
+            if row["rn"] > cap:
+                # look-ahead row, only tells us the level has more
+                if row["depth"] == 0:
+                    next_cursor = encode_cursor(top[-1]["created_at"], top[-1]["id"])
+                else:
+                    parent = nodes[row["reply_to_id"]]
+                    last = parent["replies"][-1]
+                    parent["replies_cursor"] = encode_cursor(last["created_at"], last["id"])
+                    parent["has_more_replies"] = True
+                continue
+            node = {
+                key: row[key]
+                for key in ("id", "content", "is_reply", "post_id", "author_id", "reply_to_id", "created_at", "updated_at", "depth")
+            }
+            node.update(replies=[], replies_cursor=None, has_more_replies=bool(row["replies_not_loaded"]))
+            nodes[node["id"]] = node
+            if row["depth"] == 0:
+                top.append(node)
+            else:
+                nodes[row["reply_to_id"]]["replies"].append(node)
+        return top, next_cursor
@@ -0,0 +1,252 @@
+'''
+home timeline, fan-out on write with a pull path for big accounts.
+
+when a post is created a timeline.fan_out job (app/core/jobs.py) pushes its id
+into timeline_entries for every follower of the author, so reading a feed is a range scan on the timeline primary key.
+authors with more than TIMELINE_FANOUT_MAX_FOLLOWERS followers are not fanned
+out, their posts are pulled at read time and merged into the page instead.
+every timeline a fan-out or a follow backfill wrote to is cut back to its
+newest TIMELINE_MAX_ENTRIES entries in the same transaction.
+'''
+from uuid import UUID
+
+from sqlalchemy import delete, literal, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import read_only
+from app.core.jobs import enqueue, job_registry
+from app.users.counters import counter_buffer
+from app.users.blocks import BlockHandler
+from app.users.helpers import decode_cursor, encode_cursor
+from app.users.models import Follow, Post, TimelineEntry, User
+from config import settings
+
+# cut the timeline of every reader back to the newest :cap entries. the readers
+# are :user_ids plus every follower of :fanned_out_ids
+_TRIM_READERS = text(
+    """
+    DELETE FROM timeline_entries t
+    USING (
+        SELECT r.user_id, c.created_at, c.post_id
+        FROM (
+            SELECT follower_id AS user_id FROM follows WHERE followee_id = ANY(CAST(:fanned_out_ids AS uuid[]))
+            UNION
+            SELECT unnest(CAST(:user_ids AS uuid[]))
+        ) r
+        CROSS JOIN LATERAL (
+            SELECT created_at, post_id FROM timeline_entries
+            WHERE user_id = r.user_id
+            ORDER BY created_at DESC, post_id DESC
+            OFFSET :cap LIMIT 1
+        ) c
+    ) cut
+    WHERE t.user_id = cut.user_id
+      AND (t.created_at, t.post_id) <= (cut.created_at, cut.post_id)
+    """
+)
+
+
+FAN_OUT_JOB = "timeline.fan_out"
+
+
+class TimelineHandler:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    def enqueue_fan_out(self, posts: list[Post]) -> None:
+        '''
+        queue the fan-out of `posts` in the caller's transaction, it runs once
+        that commits
+        '''
+        enqueue(self.session, FAN_OUT_JOB, {"post_ids": [str(post.id) for post in posts]})
+
+    def _is_celebrity(self, followers_count: int) -> bool:
+        return followers_count > settings.TIMELINE_FANOUT_MAX_FOLLOWERS
+
+    async def fan_out(self, post: Post) -> None:
+        await self.fan_out_many([post])
+
+    async def fan_out_many(self, posts: list[Post]) -> None:
+        authors, fanned_out = set(), set()
+        for post in posts:
+            authors.add(post.author_id)
+            if await self._push(post):
+                fanned_out.add(post.author_id)
+        await self.trim(authors, fanned_out)
+        await self.session.commit()
+
+    async def _push(self, post: Post) -> bool:
+        '''
+        push a freshly created post into the timelines of the author and,
+        unless the author is a big account, of all their followers. true when
+        the followers got it too.
+        '''
+        result = await self.session.execute(select(User.followers_count).where(User.id == post.author_id))
+        followers_count = result.scalar_one_or_none() or 0
+
+        readers = select(
+            literal(post.author_id).label("user_id"),
+            literal(post.created_at).label("created_at"),
+            literal(post.id).label("post_id"),
+            literal(post.author_id).label("author_id"),
+        )
+        fanned_out = bool(followers_count) and not self._is_celebrity(followers_count)
+        if fanned_out:
+            readers = readers.union_all(
+                select(
+                    Follow.follower_id,
+                    literal(post.created_at),
+                    literal(post.id),
+                    literal(post.author_id),
+                ).where(Follow.followee_id == post.author_id)
+            )
+        columns = ["user_id", "created_at", "post_id", "author_id"]
+        await self.session.execute(_insert_entries(columns, readers))
+        return fanned_out
+
+    async def trim(self, user_ids, fanned_out_ids=()) -> None:
+        '''
+        keep at most TIMELINE_MAX_ENTRIES entries in the timeline of each of
+        `user_ids` and of every follower of `fanned_out_ids`
+        '''
+        await self.session.execute(_TRIM_READERS, {
+            "user_ids": [UUID(str(user_id)) for user_id in user_ids],
+            "fanned_out_ids": [UUID(str(author_id)) for author_id in fanned_out_ids],
+            "cap": settings.TIMELINE_MAX_ENTRIES,
+        })
+
+    @read_only
+    async def feed(self, user_id: UUID, cursor: str | None = None, limit: int = 20) -> tuple[list, str | None]:
+        '''
+        returns ([(post, author_username)], next_cursor) newest first
+        '''
+        seek = decode_cursor(cursor) if cursor else None
+        hidden = await BlockHandler(self.session).hidden_user_ids(user_id)
+
+        pushed = (
+            select(Post, User.username)
+            .join(TimelineEntry, TimelineEntry.post_id == Post.id)
+            .join(User, User.id == Post.author_id)
+            .where(TimelineEntry.user_id == user_id)
+        )
+        if seek:
+            pushed = pushed.where(tuple_(TimelineEntry.created_at, TimelineEntry.post_id) < tuple_(*seek))
+        if hidden:
+            pushed = pushed.where(TimelineEntry.author_id.not_in(hidden))
+        pushed = pushed.order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc()).limit(limit + 1)
+        rows = list((await self.session.execute(pushed)).all())
+
+        # pull path for followed big accounts that were never fanned out
+        celebrities = (
+            select(Follow.followee_id)
+            .join(User, User.id == Follow.followee_id)
+            .where(
+                Follow.follower_id == user_id,
+                User.followers_count > settings.TIMELINE_FANOUT_MAX_FOLLOWERS,
+            )
+        )
+        pulled = (
+            select(Post, User.username)
+            .join(User, User.id == Post.author_id)
+            .where(Post.author_id.in_(celebrities))
+        )
+        if seek:
+            pulled = pulled.where(tuple_(Post.created_at, Post.id) < tuple_(*seek))
+        if hidden:
+            pulled = pulled.where(Post.author_id.not_in(hidden))
+        pulled = pulled.order_by(Post.created_at.desc(), Post.id.desc()).limit(limit + 1)
+        rows.extend((await self.session.execute(pulled)).all())
+
+        seen = set()
+        merged = []
+        for row in sorted(rows, key=lambda r: (r[0].created_at, r[0].id), reverse=True):
+            if row[0].id not in seen:
+                seen.add(row[0].id)
+                merged.append(row)
+        counter_buffer.merge_into([post for post, _ in merged])
+        if len(merged) <= limit:
+            return merged, None
+        page = merged[:limit]
+        return page, encode_cursor(page[-1][0].created_at, page[-1][0].id)
+
+    async def backfill(self, user_id: UUID, followee_id: UUID) -> None:
+        recent = (
+            select(
+                literal(user_id),
+                Post.created_at,
+                Post.id,
+                Post.author_id,
+            )
+            # an INSERT ... SELECT gets no soft delete criteria, see app/core/database.py
+            .where(Post.author_id == followee_id, Post.is_delete.is_(None))
+            .order_by(Post.created_at.desc(), Post.id.desc())
+            .limit(settings.TIMELINE_BACKFILL)
+        )
+        await self.session.execute(_insert_entries(["user_id", "created_at", "post_id", "author_id"], recent))
+        await self.trim([user_id])
+
+    async def remove_author(self, user_id: UUID, author_id: UUID) -> None:
+        await self.session.execute(
+            delete(TimelineEntry).where(TimelineEntry.user_id == user_id, TimelineEntry.author_id == author_id)
+        )
+
+
+def _insert_entries(columns: list[str], statement):
+    return insert(TimelineEntry).from_select(columns, statement).on_conflict_do_nothing()
+
+
+class FollowHandler:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def follow(self, follower_id: UUID, followee_id: UUID) -> bool:
+        if str(follower_id) == str(followee_id):
+            raise ValueError("InvalidFollow : you can't follow yourself")
+        # checked up front, the insert below reports a missing user and an
+        # existing follow both as an IntegrityError
+        followee = await self.session.execute(select(User.id).where(User.id == followee_id))
+        if followee.scalar_one_or_none() is None:
+            raise LookupError(f"UserNotFound : {followee_id}")
+        self.session.add(Follow(follower_id=follower_id, followee_id=followee_id))
+        try:
+            await self.session.flush()
+        except IntegrityError:
+            await self.session.rollback()
+            return False
+        await self._bump(follower_id, followee_id, 1)
+
+        followee = await self.session.execute(select(User.followers_count).where(User.id == followee_id))
+        if followee.scalar_one() <= settings.TIMELINE_FANOUT_MAX_FOLLOWERS:
+            await TimelineHandler(self.session).backfill(follower_id, followee_id)
+        await self.session.commit()
+        return True
+
+    async def unfollow(self, follower_id: UUID, followee_id: UUID) -> bool:
+        result = await self.session.execute(
+            delete(Follow).where(Follow.follower_id == follower_id, Follow.followee_id == followee_id)
+        )
+        if not result.rowcount:
+            return False
+        await self._bump(follower_id, followee_id, -1)
+        await TimelineHandler(self.session).remove_author(follower_id, followee_id)
+        await self.session.commit()
+        return True
+
+    async def _bump(self, follower_id: UUID, followee_id: UUID, delta: int) -> None:
+        await self.session.execute(
+            update(User).where(User.id == follower_id).values(following_count=User.following_count + delta)
+        )
+        await self.session.execute(
+            update(User).where(User.id == followee_id).values(followers_count=User.followers_count + delta)
+        )
+
+
+@job_registry.register(FAN_OUT_JOB)
+async def fan_out_job(session: AsyncSession, payload: dict) -> None:
+    # timeline inserts ignore conflicts, so a rerun after a crash is harmless
+    result = await session.execute(select(Post).where(Post.id.in_([UUID(post_id) for post_id in payload["post_ids"]])))
+    posts = result.scalars().all()
+    if posts:
+        await TimelineHandler(session).fan_out_many(posts)
@@ -0,0 +1,265 @@
+'''
+view event ingestion.
+
+the endpoint only puts a batch of views on a bounded asyncio queue. a
+background task drains the queue and aggregates per post in memory: the view
+count goes to counter_buffer (Post.views_count, written with the other
+counters) and the viewer ids go into a HyperLogLog sketch per post that is
+merged into post_view_sketches once per VIEW_FLUSH_INTERVAL, or as soon as
+VIEW_MAX_PENDING_POSTS posts have a sketch buffered. the consumer waits for
+that early flush, so the queue fills up and turns views away rather than the
+buffered sketches growing without bound.
+'''
+import asyncio
+import hashlib
+import logging
+import math
+from datetime import datetime
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import async_session_maker, read_only
+from app.users.counters import counter_buffer
+from app.users.models import Post, PostViewSketch
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class HyperLogLog:
+    '''
+    2**precision one byte registers, standard error about 1.04 / sqrt(2**precision)
+    (1.6% and 4 KiB per post at precision 12)
+    '''
+
+    def __init__(self, precision: int, registers: bytes | None = None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError(f"InvalidSketch : expected {self.size} registers, got {len(self.registers)}")
+
+    def add(self, value: str) -> None:
+        hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        bits = 64 - self.precision
+        index = hashed >> bits
+        # position of the first 1 bit in the remaining bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # linear counting is more accurate while most registers are empty
+            return round(size * math.log(size / zeros))
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+
+class ViewIngestor:
+    '''
+    at most `queue_size` views wait in the queue, a batch that does not fit is
+    turned away with a 503 so the client can retry later.
+    '''
+
+    def __init__(self, queue_size: int, interval: float, precision: int, max_pending_posts: int):
+        self.queue_size = queue_size
+        self.interval = interval
+        self.precision = precision
+        self.max_pending_posts = max_pending_posts
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._queued = 0
+        # post_id -> sketch of the viewers seen since the last flush
+        self._sketches: dict[UUID, HyperLogLog] = {}
+        # sketches handed to a flush that has not committed yet, still merged into reads
+        self._in_flight: dict[UUID, HyperLogLog] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._lock = asyncio.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def submit(self, viewer_id: UUID, post_ids: list[UUID]) -> int:
+        if self._queued + len(post_ids) > self.queue_size:
+            self.rejected += len(post_ids)
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self._queue.put_nowait((str(viewer_id), [UUID(str(post_id)) for post_id in post_ids]))
+        self._queued += len(post_ids)
+        self.accepted += len(post_ids)
+        return len(post_ids)
+
+    def _sketch(self, post_id: UUID) -> HyperLogLog:
+        sketch = self._sketches.get(post_id)
+        if sketch is None:
+            sketch = self._sketches[post_id] = HyperLogLog(self.precision)
+        return sketch
+
+    def _aggregate(self, viewer_id: str, post_ids: list[UUID]) -> None:
+        for post_id in post_ids:
+            counter_buffer.incr(Post, post_id, "views_count")
+            self._sketch(post_id).add(viewer_id)
+        self._queued -= len(post_ids)
+
+    def pending_sketch(self, post_id: UUID) -> HyperLogLog | None:
+        post_id = UUID(str(post_id))
+        sketches = [source[post_id] for source in (self._in_flight, self._sketches) if post_id in source]
+        if not sketches:
+            return None
+        merged = HyperLogLog(self.precision)
+        for sketch in sketches:
+            merged.merge(sketch)
+        return merged
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._sketches:
+                return 0
+            sketches = self._in_flight = self._sketches
+            self._sketches = {}
+            post_ids = sorted(sketches)
+            try:
+                async with async_session_maker() as session:
+                    live = (await session.execute(select(Post.id).where(Post.id.in_(post_ids)))).scalars().all()
+                    if live:
+                        # create missing rows first so the FOR UPDATE below has
+                        # something to lock when two workers flush the same post
+                        await session.execute(
+                            insert(PostViewSketch)
+                            .values([
+                                {"post_id": post_id, "registers": HyperLogLog(self.precision).to_bytes(), "unique_viewers": 0, "updated_at": datetime.now()}
+                                for post_id in sorted(live)
+                            ])
+                            .on_conflict_do_nothing()
+                        )
+                        stored = await session.execute(
+                            select(PostViewSketch.post_id, PostViewSketch.registers)
+                            .where(PostViewSketch.post_id.in_(live))
+                            .order_by(PostViewSketch.post_id)
+                            .with_for_update()
+                        )
+                        rows = []
+                        for post_id, registers in stored.all():
+                            sketch = sketches[post_id]
+                            sketch.merge(HyperLogLog(self.precision, registers))
+                            rows.append({
+                                "post_id": post_id,
+                                "registers": sketch.to_bytes(),
+                                "unique_viewers": sketch.count(),
+                                "updated_at": datetime.now(),
+                            })
+                        await session.execute(update(PostViewSketch), rows)
+                    await session.commit()
+            except Exception:
+                self.failures += 1
+                # merging is idempotent, hand everything back for the next attempt
+                for post_id, sketch in sketches.items():
+                    self._sketch(post_id).merge(sketch)
+                raise
+            finally:
+                self._in_flight = {}
+            self.flushes += 1
+            return len(post_ids)
+
+    async def _consume(self) -> None:
+        while True:
+            viewer_id, post_ids = await self._queue.get()
+            self._aggregate(viewer_id, post_ids)
+            if len(self._sketches) >= self.max_pending_posts:
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("view sketch flush failed")
+                    # the sketches are still buffered, don't retry on every batch
+                    await asyncio.sleep(self.interval)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("view sketch flush failed")
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._consume()), asyncio.create_task(self._run())]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        # drain the queue, views_count goes out with counter_buffer.stop()
+        while not self._queue.empty():
+            self._aggregate(*self._queue.get_nowait())
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queued,
+            "pending_posts": len(self._sketches),
+            "in_flight_posts": len(self._in_flight),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "failures": self.failures,
+        }
+
+
+class PostViewHandler:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    @read_only
+    async def view_counts(self, post_id: UUID) -> dict | None:
+        '''
+        views and unique viewers of a post including what has not been flushed yet
+        '''
+        statement = (
+            select(Post.views_count, PostViewSketch.registers, PostViewSketch.unique_viewers)
+            .outerjoin(PostViewSketch, PostViewSketch.post_id == Post.id)
+            .where(Post.id == post_id)
+        )
+        row = (await self.session.execute(statement)).first()
+        if row is None:
+            return None
+        unique_viewers = row.unique_viewers or 0
+        pending = view_ingestor.pending_sketch(post_id)
+        if pending is not None:
+            sketch = HyperLogLog(view_ingestor.precision, row.registers)
+            sketch.merge(pending)
+            unique_viewers = sketch.count()
+        return {
+            "post_id": str(post_id),
+            "views_count": row.views_count + counter_buffer.pending(Post, post_id).get("views_count", 0),
+            "unique_viewers": unique_viewers,
+        }
+
+
+view_ingestor = ViewIngestor(
+    queue_size=settings.VIEW_QUEUE_SIZE,
+    interval=settings.VIEW_FLUSH_INTERVAL,
+    precision=settings.VIEW_SKETCH_PRECISION,
+    max_pending_posts=settings.VIEW_MAX_PENDING_POSTS,
+)
@@ -0,0 +1,40 @@
+'''
+the hot handler queries, run once per worker at startup with ids that match
+no rows. that fills SQLAlchemy's compiled cache and the repository statement
+cache and lets asyncpg prepare the statements, so the first real requests
+skip all of it.
+'''
+from datetime import datetime
+from uuid import uuid4
+
+from app.core.database import async_session_maker
+from app.users.blocks import BlockHandler
+from app.users.cache import block_cache, like_cache
+from app.users.crud import PostLikeHandler, PostServiceHandler, UserServiceHandler
+from app.users.helpers import encode_cursor
+from app.users.schemas import PostFetchSchema
+from app.users.timeline import TimelineHandler
+
+
+async def warm_hot_queries() -> None:
+    probe = uuid4()
+    async with async_session_maker() as session:
+        users = UserServiceHandler(session)
+        # login, token check, fetch_user
+        await users.get_user_by_username(f"warmup-{probe.hex[:16]}")
+        await users.get_user_by_email(f"warmup-{probe.hex}@example.invalid")
+        await users.get_user_status(probe)
+        await users.get_user_by_id(probe)
+
+        # fetch_all_post_for_user, first and later pages
+        posts = PostServiceHandler(session)
+        await posts.paginate({"author_id": probe}, limit=20, schema=PostFetchSchema)
+        await posts.paginate({"author_id": probe}, cursor=encode_cursor(datetime.now(), probe), limit=20, schema=PostFetchSchema)
+
+        await PostLikeHandler(session).liked_post_ids(probe, [probe])
+        await BlockHandler(session).block_sets(probe)
+        await TimelineHandler(session).feed(probe)
+
+    # don't leave the probe user in the caches
+    like_cache.invalidate(str(probe))
+    block_cache.invalidate(str(probe))
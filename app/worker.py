@@ -0,0 +1,45 @@
+'''
+standalone job worker, for running background jobs (and the soft delete
+purge) apart from the api.
+
+    python -m app.worker
+
+set JOBS_RUN_IN_APP=false on the api processes to leave all of it to these.
+'''
+import asyncio
+import logging
+import signal
+
+from app.core.database import dispose_engines
+from app.core.jobs import job_registry, job_worker
+from app.core.logs import configure_logging
+from app.users.counters import counter_buffer
+from app.users.purge import soft_delete_purger
+# registers the job handlers
+import app.users.timeline  # noqa: F401
+from config import settings
+
+logger = logging.getLogger("app.worker")
+
+
+async def main() -> None:
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    counter_buffer.start()
+    job_worker.start()
+    soft_delete_purger.start()
+    logger.info("job worker started", extra={"kinds": sorted(job_registry)})
+    await stopping.wait()
+    logger.info("job worker stopping")
+    await job_worker.stop()
+    await soft_delete_purger.stop()
+    await counter_buffer.stop()
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    configure_logging(settings.LOG_LEVEL, as_json=settings.LOG_JSON)
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+'''
+per-row serialization cost of a listing page, old path vs page_response.
+
+    python -m benchmarks.serialization --rows 1000 --repeat 50
+
+old: PostFetchSchema.model_validate + model_dump per row, ResponseSchema,
+     response_model validation + jsonable_encoder in FastAPI, json.dumps
+new: one TypeAdapter pass from rows to JSON bytes
+'''
+import argparse
+import statistics
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from uuid import uuid4
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.core.responses import FastJSONResponse, page_response
+from app.users.schemas import PostFetchSchema, ResponseSchema
+
+
+def make_rows(count: int) -> list:
+    now = datetime.now()
+    return [
+        SimpleNamespace(
+            id=uuid4(),
+            title=f"post {i}",
+            is_text=True,
+            text_content="lorem ipsum " * 20,
+            media_url=None,
+            is_reel=False,
+            caption="caption",
+            author_id=uuid4(),
+            author_username=f"user_{i}",
+            likes_count=i,
+            comment_count=i // 2,
+            views_count=i * 10,
+            share_count=i // 3,
+            created_at=now,
+            updated_at=now,
+        )
+        for i in range(count)
+    ]
+
+
+def old_path(rows: list, response_class=JSONResponse) -> bytes:
+    resp = [PostFetchSchema.model_validate(row, from_attributes=True).model_dump() for row in rows]
+    body = ResponseSchema(
+        message="post fetched succesfully",
+        status="success",
+        status_code=200,
+        data_list=resp,
+        pagination_data={"page_size": len(rows)},
+    )
+    # what FastAPI does with response_model=ResponseSchema
+    validated = ResponseSchema.model_validate(body.model_dump())
+    return response_class(jsonable_encoder(validated)).body
+
+
+def new_path(rows: list) -> bytes:
+    return page_response(
+        PostFetchSchema,
+        rows,
+        message="post fetched succesfully",
+        pagination_data={"page_size": len(rows)},
+    ).body
+
+
+def measure(fn, rows: list, repeat: int) -> float:
+    fn(rows)  # warm up, builds the TypeAdapter on first use
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(rows)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    cases = {
+        "old (json)": lambda r: old_path(r),
+        "old (orjson response class)": lambda r: old_path(r, FastJSONResponse),
+        "page_response": new_path,
+    }
+    baseline = None
+    for name, fn in cases.items():
+        seconds = measure(fn, rows, args.repeat)
+        baseline = baseline or seconds
+        print(
+            f"{name:<30} page {seconds * 1000:8.2f} ms   "
+            f"per row {seconds / args.rows * 1e6:7.2f} us   x{baseline / seconds:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
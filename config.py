@@ -2,10 +2,6 @@ from pydantic import  AnyHttpUrl
 from pydantic_settings import BaseSettings
 from typing import List
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import create_async_engine
-from fastapi import FastAPI
-from sqlmodel import SQLModel,create_engine
-from sqlalchemy.ext.asyncio import AsyncEngine
 
 
 
@@ -13,10 +9,88 @@ class Settings(BaseSettings):
     APP_NAME: str = "Social Media API"
     DEBUG: bool = True
     DATABASE_URL: str
+    REPLICA_DATABASE_URL: str | None = None
+    DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = False
+    DB_STATEMENT_CACHE_SIZE: int = 500
+    DB_WARMUP_CONNECTIONS: int = 5
+    DB_WARMUP_QUERIES: bool = True
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_SECONDS: int = 300
     ALLOWED_ORIGINS: List[AnyHttpUrl] = ["http://localhost:3000"]
+    USER_STATUS_CACHE_SIZE: int = 50_000
+    USER_STATUS_CACHE_TTL: int = 60
+    TOKEN_REVOCATION_BACKEND: str = "memory"  # memory | sql
+    TOKEN_REVOCATION_URL: str = "sqlite:///./revoked_tokens.db"
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+    COUNTER_FLUSH_INTERVAL: float = 2.0
+    TIMELINE_MAX_ENTRIES: int = 800
+    TIMELINE_FANOUT_MAX_FOLLOWERS: int = 10_000
+    TIMELINE_BACKFILL: int = 50
+    BULK_INSERT_CHUNK: int = 500
+    BULK_MAX_ITEMS: int = 1000
+    EXPORT_BATCH_SIZE: int = 1000
+    COUNT_CACHE_SIZE: int = 10_000
+    COUNT_CACHE_TTL: int = 30
+    LIKE_CACHE_ENABLED: bool = True
+    LIKE_CACHE_USERS: int = 20_000
+    LIKE_CACHE_TTL: int = 300
+    LIKE_CACHE_POSTS_PER_USER: int = 2_000
+    BLOCK_CACHE_USERS: int = 50_000
+    BLOCK_CACHE_TTL: int = 60
+    POST_CACHE_SIZE: int = 10_000
+    POST_CACHE_TTL: int = 15
+    AUTOCOMPLETE_HOT_USERS: int = 50_000
+    AUTOCOMPLETE_REFRESH_SECONDS: int = 300
+    VIEW_QUEUE_SIZE: int = 100_000
+    VIEW_FLUSH_INTERVAL: float = 5.0
+    VIEW_BATCH_MAX: int = 500
+    VIEW_SKETCH_PRECISION: int = 12
+    # posts with a sketch buffered between flushes, each one is 2**precision bytes
+    VIEW_MAX_PENDING_POSTS: int = 5_000
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True
+    METRICS_ENABLED: bool = True
+    N_PLUS_ONE_THRESHOLD: int = 10
+    SLOW_REQUEST_SECONDS: float = 1.0
+    JOBS_RUN_IN_APP: bool = True
+    JOB_CONCURRENCY: int = 4
+    JOB_BATCH_SIZE: int = 10
+    JOB_POLL_INTERVAL: float = 1.0
+    JOB_LEASE_SECONDS: int = 300
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_BASE_SECONDS: float = 2.0
+    SOFT_DELETE_RETENTION_DAYS: int = 30
+    PURGE_BATCH_SIZE: int = 200
+    PURGE_INTERVAL_SECONDS: float = 3600.0
+    PURGE_BATCH_PAUSE: float = 0.5
+    PURGE_LOCK_TIMEOUT_MS: int = 2000
+    MEDIA_ROOT: str = "./media"
+    MEDIA_MAX_BYTES: int = 2 * 1024 ** 3
+    MEDIA_URL_PREFIX: str = "/users/media/"
+    MEDIA_ALLOWED_TYPES: List[str] = [
+        "image/jpeg", "image/png", "image/gif", "image/webp",
+        "video/mp4", "video/quicktime", "video/webm",
+    ]
+    # set when nginx serves MEDIA_ROOT as an internal location, downloads are
+    # then handed off with X-Accel-Redirect and sent with sendfile by nginx
+    MEDIA_X_ACCEL_PREFIX: str | None = None
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"  # memory | sql
+    RATE_LIMIT_URL: str = "sqlite:///./rate_limits.db"
+    # only enable behind a proxy that sets the header, clients can forge it
+    RATE_LIMIT_TRUST_FORWARDED: bool = False
+    # path -> {"ip" | "username": "<count>/<second|minute|hour|day>"}
+    RATE_LIMIT_POLICIES: dict[str, dict[str, str]] = {
+        "/auth/login/": {"ip": "20/minute", "username": "5/minute"},
+        "/auth/register/": {"ip": "5/minute"},
+    }
 
     class Config:
         env_file = ".env"
@@ -28,10 +102,7 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
-engine = create_async_engine(
-    settings.DATABASE_URL,  # must be asyncpg URL
-    echo=True,
-)
+# engines and sessions live in app/core/database.py
 
 # async def initdb():
 #     """create our database models in the database"""
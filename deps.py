@@ -1,14 +1,7 @@
 '''
 These are all global dependencies
 '''
-from config import engine
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import sessionmaker
-
-# create a sessionmaker bound to async engine
-async_session_maker = sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
-)
+from app.core.database import async_session_maker
 
 # dependency
 async def get_session():
@@ -1,34 +1,84 @@
 # app/main.py
+import time
+
+_import_started = time.perf_counter()
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 # from app.api.routes import auth, users, posts, comments, likes, messages
 from config import settings
 from contextlib import asynccontextmanager
-from dotenv import load_dotenv
+import logging
 # from config import initdb
 from app.auth.routes import router as auth_router
 from app.users.routes import router as users_router
+from app.users.cache import user_status_cache, like_cache, block_cache, post_cache
+from app.auth.hashing import password_hasher
+from app.core.database import dispose_engines, pool_stats, warm_pool
+from app.core.lifecycle import startup
+from app.core.jobs import job_worker
+from app.users.warmup import warm_hot_queries
+from app.users.purge import soft_delete_purger
+from app.users.counters import counter_buffer
+from app.core.responses import FastJSONResponse
+from app.users.counts import count_cache
+from app.users.search import username_index
+from app.users.views import view_ingestor
+from app.core.ratelimit import RateLimitMiddleware, build_rate_limit_backend, parse_policies
+from app.core.logs import configure_logging
+from app.core.metrics import MetricsMiddleware, render_metrics
+from fastapi.responses import PlainTextResponse, JSONResponse
+
+configure_logging(settings.LOG_LEVEL, as_json=settings.LOG_JSON)
+logger = logging.getLogger("app")
 
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):    
-    print("Server is starting...")
-    load_dotenv()
-    print("loaded all the env variables")
+    logger.info("server is starting")
     # await initdb()
-    print("Database connected")
+    password_hasher.start()
+    counter_buffer.start()
+    view_ingestor.start()
+    if settings.JOBS_RUN_IN_APP:
+        job_worker.start()
+        soft_delete_purger.start()
+    warm_up_steps = [("pool", lambda: warm_pool(settings.DB_WARMUP_CONNECTIONS))]
+    if settings.DB_WARMUP_QUERIES:
+        warm_up_steps.append(("queries", warm_hot_queries))
+    startup.start_warm_up(warm_up_steps)
     yield
-    print("server is stopping")
+    logger.info("server is stopping")
+    # views feed counter_buffer, so they are drained first
+    await view_ingestor.stop()
+    await startup.stop()
+    # jobs may bump counters, stop them before the last counter flush
+    await job_worker.stop()
+    await soft_delete_purger.stop()
+    await counter_buffer.stop()
+    password_hasher.shutdown()
+    await dispose_engines()
     
 app = FastAPI(
     title="Social Media API",
     version="1.0.0",
     description="Backend for a social media app built with FastAPI",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
     
+rate_limit_backend = build_rate_limit_backend(settings.RATE_LIMIT_BACKEND, settings.RATE_LIMIT_URL)
+
+# added before CORS so CORS wraps it and 429s still carry the CORS headers
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(
+        RateLimitMiddleware,
+        backend=rate_limit_backend,
+        policies=parse_policies(settings.RATE_LIMIT_POLICIES),
+        trust_forwarded=settings.RATE_LIMIT_TRUST_FORWARDED,
+    )
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -38,6 +88,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# outermost, so rate limited and CORS preflight requests are timed as well
+if settings.METRICS_ENABLED:
+    app.add_middleware(
+        MetricsMiddleware,
+        n_plus_one_threshold=settings.N_PLUS_ONE_THRESHOLD,
+        slow_request_seconds=settings.SLOW_REQUEST_SECONDS,
+    )
+
 # # Include all API routers
 app.include_router(auth_router, prefix="/auth", tags=["Auth"])
 app.include_router(users_router, prefix="/users", tags=["Users"])
@@ -50,3 +108,38 @@ app.include_router(users_router, prefix="/users", tags=["Users"])
 @app.get("/", tags=["Health"])
 def read_root():
     return {"message": "Social Media API is running."}
+
+
+# readiness, 503 until the pool is warm and the hot queries are compiled
+@app.get("/ready/", tags=["Health"])
+def read_ready():
+    return JSONResponse(startup.status(), status_code=200 if startup.ready else 503)
+
+
+# in-process cache counters, per worker
+@app.get("/stats/", tags=["Health"])
+def read_stats():
+    return {
+        "user_status_cache": user_status_cache.stats(),
+        "like_cache": like_cache.stats(),
+        "block_cache": block_cache.stats(),
+        "post_cache": post_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "db_pool": pool_stats(),
+        "counter_buffer": counter_buffer.stats(),
+        "count_cache": count_cache.stats(),
+        "username_index": username_index.stats(),
+        "view_ingestor": view_ingestor.stats(),
+        "rate_limit": rate_limit_backend.stats(),
+        "job_worker": job_worker.stats(),
+        "soft_delete_purger": soft_delete_purger.stats(),
+    }
+
+
+@app.get("/metrics", tags=["Health"], include_in_schema=False)
+def read_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+# everything above ran at import, the lifespan warm-up is timed separately
+startup.record("import_seconds", time.perf_counter() - _import_started)